@@ -1,4 +1,4 @@
-from dash import Dash, dcc, html, Input, Output, State, callback_context, dash_table
+from dash import Dash, dcc, html, Input, Output, State, callback_context, dash_table, Patch, no_update
 import dash_bootstrap_components as dbc
 from dash_bootstrap_components._components.Container import Container
 from plotly.subplots import make_subplots
@@ -19,6 +19,8 @@ import plotly.express as px
 from rq import Queue
 from worker import conn
 
+import os
+import time
 import logging
 from scipy.signal import find_peaks
 from scipy.optimize import curve_fit
@@ -26,7 +28,9 @@ from scipy import stats
 
 # set ThingSpeak variables
 # 3 sets of data, since there are 3 IODR devices
-tsBaseUrl = r'https://api.thingspeak.com/channels'
+# set THINGSPEAK_BASE_URL to use another server, like the local stand-in in thingspeak_standin.py
+tsBaseUrl = os.getenv('THINGSPEAK_BASE_URL', r'https://api.thingspeak.com/channels')
+set_base_url(tsBaseUrl)
 
 # IODR device numbers (as of 10-27-2020)
 # 1: device in Zeppelin chamber
@@ -60,6 +64,17 @@ server = app.server
 # for heroku server, will find source
 server.wsgi_app = WhiteNoise(server.wsgi_app, root='static/c')
 
+# keep running fits of every tube up to date as new rows come in for the OD channels, the table estimates of tubes
+# without an exponential phase come from them
+add_append_listener(update_online_fits, chIDs[:3])
+
+# keep the data of all three devices ready in the background so the device buttons only read a cache.
+# set IODR_PREWARM_INTERVAL to 0 to turn this off. When this file is run directly, the growth model fit processes
+# load it again as __mp_main__, and they don't poll
+prewarm_interval = float(os.getenv('IODR_PREWARM_INTERVAL', 60))
+if prewarm_interval > 0 and __name__ != '__mp_main__':
+    start_prewarm_poller(chIDs, readAPIkeys, interval=prewarm_interval)
+
 # the html layout of the app
 app.layout = html.Div([
     # this is the sticky header division at the top of the page
@@ -85,6 +100,13 @@ app.layout = html.Div([
                 className='IODR-button',
                 style={'width': 130, 'height': 50, 'font-size': 20}
             ),
+            # optional start date to load history further back than the last 8000 points
+            dcc.DatePickerSingle(
+                id='history-start-picker',
+                placeholder='Load since...',
+                clearable=True,
+                style={'verticalAlign': 'middle'}
+            ),
             html.Button(
                 'Download CSV',
                 id='download-button',
@@ -115,11 +137,22 @@ app.layout = html.Div([
     html.Br(),
 
     # graph html component
-    html.Div(
+    html.Div(children=[
+        # draw the OD or ln OD plot as min/max bands with a mean line instead of points
+        dcc.Checklist(
+            options=[
+                {'label': 'OD envelope', 'value': 'od'},
+                {'label': 'ln OD envelope', 'value': 'ln'}
+            ],
+            value=[],
+            id='envelope-checklist',
+            inline=True,
+            style={'marginLeft': 100}
+        ),
         dcc.Loading(
             dcc.Graph(
                 id='graph1')
-        ),
+        )],
         style={'marginTop': 150}
     ),
     # table to input tube names
@@ -134,7 +167,10 @@ app.layout = html.Div([
                     {'name': 'Target OD', 'id': 'target', 'type': 'numeric', 'editable': True},
                     {'name': 'OD Offset', 'id': 'offset', 'type': 'numeric', 'editable': True},
                     {'name': 'Est. Time/Date', 'id': 'estimate', 'type': 'text', 'editable': False},
-                    {'name': 'R value', 'id': 'r value', 'type': 'numeric', 'editable': False}
+                    {'name': 'R value', 'id': 'r value', 'type': 'numeric', 'editable': False},
+                    {'name': 'Lag (h)', 'id': 'lag', 'type': 'numeric', 'editable': False},
+                    {'name': 'µmax (1/h)', 'id': 'mu max', 'type': 'numeric', 'editable': False},
+                    {'name': 'Max OD', 'id': 'capacity', 'type': 'numeric', 'editable': False}
                 ],
                 # input some data on startup
                 data=[
@@ -174,6 +210,18 @@ app.layout = html.Div([
             id='clear-button',
             style={'width': 100, 'height': 60, 'font-size': 20}
         ),
+        # growth model fitted to each tube for the lag, µmax and max OD columns when the tubes are updated
+        dcc.Dropdown(
+            options=[
+                {'label': 'Gompertz', 'value': 'gompertz'},
+                {'label': 'Logistic', 'value': 'logistic'},
+                {'label': 'Baranyi', 'value': 'baranyi'}
+            ],
+            value='gompertz',
+            clearable=False,
+            id='growth-model-dropdown',
+            style={'width': 150, 'display': 'inline-block', 'verticalAlign': 'middle'}
+        ),
         html.Button(
             'Update Tubes',
             id='update-button',
@@ -188,7 +236,19 @@ app.layout = html.Div([
     # tube selector dropdown
     html.Div(children=[
         html.H3("Tube Selector", style={'textAlign': 'center'}),
-        dcc.Dropdown(originalNames, id='tube-dropdown')],
+        dcc.Dropdown(originalNames, id='tube-dropdown'),
+        # how the growth line is fitted, the robust fits aren't pulled off by single spikes
+        dcc.RadioItems(
+            options=[
+                {'label': 'Least squares', 'value': 'ols'},
+                {'label': 'Huber', 'value': 'huber'},
+                {'label': 'Theil-Sen', 'value': 'theilsen'}
+            ],
+            value='ols',
+            id='fit-method-radio',
+            inline=True,
+            style={'textAlign': 'center', 'marginTop': 10}
+        )],
         style={'flex': 1, 'width': '30%', 'marginLeft': '35%', 'marginTop': 30}
     ),
 
@@ -314,6 +374,9 @@ app.layout = html.Div([
     dcc.Store(data=[oldNames.copy(), oldNames.copy(), oldNames.copy()], id='newNames_store'),  # names of the tubes
     dcc.Store(id='lnDataframes_store'),  # ln dataframes, could be put into one dataframe (json)
     dcc.Store(id='zoom_vals_store'),  # values of zoom to maintain zoom levels when changing inputs for analysis
+    dcc.Store(id='growth_job_store', data={}),  # ID and start time of the running growth fits of each device's table
+    # checks on the running growth model fits, only enabled while there are some
+    dcc.Interval(id='growth-interval', interval=1000, disabled=True),
     # stores the three table dataframes as jsons
     dcc.Store(
         id='table_store',
@@ -325,7 +388,10 @@ app.layout = html.Div([
                     'target': [.5] * 8,
                     'offset': [0] * 8,
                     'estimate': [0] * 8,
-                    'r value': [0] * 8
+                    'r value': [0] * 8,
+                    'lag': ["none"] * 8,
+                    'mu max': ["none"] * 8,
+                    'capacity': ["none"] * 8
                 }
             ).to_json(date_format='iso', orient='table'),
             pd.DataFrame(
@@ -334,7 +400,10 @@ app.layout = html.Div([
                     'target': [.5] * 8,
                     'offset': [0] * 8,
                     'estimate': [0] * 8,
-                    'r value': [0] * 8
+                    'r value': [0] * 8,
+                    'lag': ["none"] * 8,
+                    'mu max': ["none"] * 8,
+                    'capacity': ["none"] * 8
                 }
             ).to_json(date_format='iso', orient='table'),
             pd.DataFrame(
@@ -343,7 +412,10 @@ app.layout = html.Div([
                     'target': [.5] * 8,
                     'offset': [0] * 8,
                     'estimate': [0] * 8,
-                    'r value': [0] * 8
+                    'r value': [0] * 8,
+                    'lag': ["none"] * 8,
+                    'mu max': ["none"] * 8,
+                    'capacity': ["none"] * 8
                 }
             ).to_json(date_format='iso', orient='table'),
         ]
@@ -361,9 +433,10 @@ app.layout = html.Div([
     Output('header-text', 'children'),
     Input('IODR1-button', 'n_clicks'),
     Input('IODR2-button', 'n_clicks'),
-    Input('IODR3-button', 'n_clicks')
+    Input('IODR3-button', 'n_clicks'),
+    State('history-start-picker', 'date')
 )
-def update_which_IODR(IODR1_button, IODR2_button, IODR3_button):  # load data on switch
+def update_which_IODR(IODR1_button, IODR2_button, IODR3_button, history_start):  # load data on switch
     # gets the changed properties that caused the callback
     changed_id = [p['prop_id'] for p in callback_context.triggered][0]
     # checks which button was pressed
@@ -376,16 +449,24 @@ def update_which_IODR(IODR1_button, IODR2_button, IODR3_button):  # load data on
     else:
         device_num = 1  # default IODR #2
 
-    # gets the full OD data frame with 8000 points
-    od_df_original_full = get_OD_dataframe(device_num, chIDs, readAPIkeys)
-    # culls the data to only take 1/10th of the data before the most recent 2 hours
-    od_df_original_culled = cull_data(od_df_original_full)
-    temp_df_full = get_temp_data(device_num, chIDs, readAPIkeys)
-    temp_df = cull_data(temp_df_full)
-
     # sets the text of the header to the current device number
     header_text = f"IODR #{device_num + 1} Viewer"
 
+    # use the data kept ready by the pre-warm poller if it is recent enough
+    prewarmed_data = get_prewarmed(device_num, 2 * prewarm_interval) if prewarm_interval > 0 else None
+    if prewarmed_data is not None and not history_start:
+        return device_num, prewarmed_data['od_df_full_json'], prewarmed_data['od_df_culled_json'], \
+            prewarmed_data['temp_df_json'], header_text
+
+    # load history back to the picked date (in Eastern time) instead of just the last 8000 points
+    start = pd.Timestamp(history_start).tz_localize('US/Eastern') if history_start else None
+
+    # gets the full OD data frame with 8000 points and the temperature data, both channels are fetched concurrently
+    od_df_original_full, temp_df_full = get_device_data(device_num, chIDs, readAPIkeys, start)
+    # culls the data to a fixed number of points per tube for the graphs
+    od_df_original_culled = cull_data(od_df_original_full)
+    temp_df = cull_data(temp_df_full)
+
     return device_num, od_df_original_full.to_json(date_format='iso', orient='table'), od_df_original_culled.to_json(
         date_format='iso', orient='table'), temp_df.to_json(date_format='iso', orient='table'), header_text
 
@@ -393,19 +474,27 @@ def update_which_IODR(IODR1_button, IODR2_button, IODR3_button):  # load data on
 @app.callback(
     Output('table_store', 'data'),
     Output('od_df_update_store', 'data'),
+    Output('growth_job_store', 'data'),
+    Output('growth-interval', 'disabled'),
     Input('update-button', 'n_clicks'),
     Input('clear-button', 'n_clicks'),
     Input('IODR_store', 'data'),
     State('table_store', 'data'),
     State('od_df_original_culled_store', 'data'),
     State('test_datatable', 'data'),
+    State('growth-model-dropdown', 'value'),
+    State('fit-method-radio', 'value'),
+    State('od_df_original_full_store', 'data'),
 )
-def update_table_df(update_button, clear_button, device_num, tables_list, od_df_original_culled_json, datatable_dict):
+def update_table_df(update_button, clear_button, device_num, tables_list, od_df_original_culled_json, datatable_dict,
+                    growth_model, fit_method, od_df_original_full_json):
     # dataframe to store the info from the datatable input element
     stored_table_df = pd.read_json(tables_list[device_num], orient='table')
     # original OD data after getting culled
     od_df_original_culled = pd.read_json(od_df_original_culled_json, orient='table')
     od_df_updated = od_df_original_culled.copy()
+    # full resolution OD data, the fits use it since culling thins out the points the fits need
+    od_df_original_full = pd.read_json(od_df_original_full_json, orient='table')
     print("beginnninggg!!!")
     print(od_df_updated)
 
@@ -445,45 +534,100 @@ def update_table_df(update_button, clear_button, device_num, tables_list, od_df_
             od_df_updated.iloc[:, j] = od_df_original_culled.iloc[:, j] + stored_table_df['offset'].iloc[j]
             print(od_df_updated.iloc[:, j])
 
-        ln_dataframes = [] # all of the ln_dataframes
-        for i in range(8):
-            # get the ln data and make it a json for storage
-            lndf = format_ln_data(od_df_updated, i).to_json(date_format='iso', orient='table')
-            ln_dataframes.append(lndf)
-
-        # get the time estimates for when each tube hits target and the r^2 vals
-        estimates, r_vals = estimate_times(ln_dataframes, targets)
+        # fit all the tubes' full resolution data with the offsets added at once over their exponential phase (the
+        # running fit of the last 2 hours if none is found), then get the time estimates for when each tube hits
+        # target and the r^2 vals. The culled data is only for the graphs
+        offsets = pd.to_numeric(stored_table_df['offset'], errors='coerce').fillna(0)
+        fits = fit_table_tubes(od_df_original_full, chIDs[device_num], targets, offsets=offsets, method=fit_method)
+        estimates, r_vals = format_estimates(fits, tz=od_df_updated.index.tz)
 
         # update the stored table
         stored_table_df['estimate'] = estimates
         stored_table_df['r value'] = r_vals
+
+        # start fitting the growth model to every tube's full resolution data in the process pool, starting from the
+        # last fit of each tube. The columns are filled in by fill_growth_columns once the fits are done
+        growth_jobs = Patch()
+        growth_jobs[str(device_num)] = {
+            'id': start_growth_job(od_df_original_full, model=growth_model, offsets=offsets,
+                                   keys=[(device_num, i) for i in range(8)]),
+            'started': time.time()
+        }
+        growth_interval_disabled = False
+        stored_table_df['lag'] = ["fitting"] * 8
+        stored_table_df['mu max'] = ["fitting"] * 8
+        stored_table_df['capacity'] = ["fitting"] * 8
     elif 'clear-button' in changed_id:  # clear stored table to original state if clear button clicked
         stored_table_df['target'] = [.5] * 8
         stored_table_df['name'] = oldNames
         stored_table_df['estimate'] = ["none"] * 8
         stored_table_df['r value'] = [0] * 8
         stored_table_df['offset'] = [0] * 8
+        stored_table_df['lag'] = ["none"] * 8
+        stored_table_df['mu max'] = ["none"] * 8
+        stored_table_df['capacity'] = ["none"] * 8
+        # growth model fits that are still running aren't filled into the cleared table
+        growth_jobs = Patch()
+        growth_jobs[str(device_num)] = None
+        growth_interval_disabled = no_update
     else:   # on opening of page
         rename_tubes(od_df_updated, stored_table_df['name'])    # rename tubes in df to "tube 1"...
         targets = [.5] * 8  # set targets to .5
 
-        ln_dataframes = []
-        for i in range(8):
-            offset_value = stored_table_df['offset'].iloc[i]    # get offset values
-            # get ln data into a dataframe and make a json for storage
-            lndf = format_ln_data(od_df_updated, i, offset_value=offset_value).to_json(date_format='iso', orient='table')
-            ln_dataframes.append(lndf)
-
-        # get the time estimates for when each tube hits target and the r^2 vals
-        estimates, r_vals = estimate_times(ln_dataframes, targets)
+        offsets = pd.to_numeric(stored_table_df['offset'], errors='coerce').fillna(0)    # get offset values
+        # get the time estimates for when each tube hits target and the r^2 vals from the full resolution data
+        fits = fit_table_tubes(od_df_original_full, chIDs[device_num], targets, offsets=offsets, method=fit_method)
+        estimates, r_vals = format_estimates(fits, tz=od_df_updated.index.tz)
 
         stored_table_df['estimate'] = estimates
         stored_table_df['r value'] = r_vals
+        growth_jobs = no_update
+        growth_interval_disabled = no_update
 
     # encode stored table as a json and store in the list of tables. One table for each IODR device
     tables_list[device_num] = stored_table_df.to_json(date_format='iso', orient='table')
 
-    return tables_list, od_df_updated.to_json(date_format='iso', orient='table')
+    return tables_list, od_df_updated.to_json(date_format='iso', orient='table'), growth_jobs, growth_interval_disabled
+
+
+@app.callback(
+    Output('table_store', 'data', allow_duplicate=True),
+    Output('growth_job_store', 'data', allow_duplicate=True),
+    Output('growth-interval', 'disabled', allow_duplicate=True),
+    Input('growth-interval', 'n_intervals'),
+    State('growth_job_store', 'data'),
+    State('table_store', 'data'),
+    prevent_initial_call=True
+)
+def fill_growth_columns(n_intervals, growth_jobs, tables_list):
+    # fill the lag, mu max and capacity columns of every table whose growth model fits are done, and stop checking
+    # once none are left running
+    filled = False
+    running = False
+    for device, job in growth_jobs.items():
+        if job is None:
+            continue
+        # the fits are saved to the shared store by the worker that started them, whichever worker this is
+        growth_fits = collect_growth_job(job['id'])
+        if growth_fits is None:
+            if time.time() - job['started'] < growth_job_timeout:
+                running = True
+                continue
+            # given up on, for example the worker that started the fits was restarted
+            growth_fits = [{'params': None}] * 8
+
+        growth_jobs[device] = None
+        stored_table_df = pd.read_json(tables_list[int(device)], orient='table')
+        stored_table_df['lag'] = [round(fit['lag'], 2) if fit['params'] is not None else "none"
+                                  for fit in growth_fits]
+        stored_table_df['mu max'] = [round(fit['mu_max'], 3) if fit['params'] is not None else "none"
+                                     for fit in growth_fits]
+        stored_table_df['capacity'] = [round(fit['capacity'], 3) if fit['params'] is not None else "none"
+                                       for fit in growth_fits]
+        tables_list[int(device)] = stored_table_df.to_json(date_format='iso', orient='table')
+        filled = True
+
+    return tables_list if filled else no_update, growth_jobs, not running
 
 
 @app.callback(
@@ -551,13 +695,16 @@ def update_tube_dropdown(tables_list, device_num, ln_tube, current_names):
     Output('graph1', 'figure'),
     Input('od_df_update_store', 'data'),
     Input('table_store', 'data'),
+    Input('envelope-checklist', 'value'),
     State('temp_df_store', 'data'),
     State('IODR_store', 'data'),
+    State('od_df_original_full_store', 'data'),
 )
-def update_graph(od_df_update_store, tables_list, temp_df_store, device_num):
+def update_graph(od_df_update_store, tables_list, envelope_modes, temp_df_store, device_num,
+                 od_df_original_full_json):
     od_df_update = pd.read_json(od_df_update_store, orient='table')
     temp_df = pd.read_json(temp_df_store, orient='table')
-    # stored_table_df = pd.read_json(tables_list[device_num], orient='table')
+    stored_table_df = pd.read_json(tables_list[device_num], orient='table')
 
     # make the subplots object
     original_data_fig = make_subplots(
@@ -575,54 +722,18 @@ def update_graph(od_df_update_store, tables_list, temp_df_store, device_num):
     elif device_num == 2:
         original_data_fig.update_layout(title="IODR #3")
 
-    index = 0
+    # min/max bands for the plots picked in the envelope checklist, the envelope is the same for both plots. They are
+    # made from all the data with the table's offsets added, not only the culled points
+    envelope = None
+    if envelope_modes:
+        offsets = pd.to_numeric(stored_table_df['offset'], errors='coerce').fillna(0).to_numpy()
+        od_df_original_full = pd.read_json(od_df_original_full_json, orient='table')
+        envelope = get_full_envelope(device_num, chIDs, od_df_original_full, offsets)
     # add the traces of each tube
-    for col in od_df_update.columns:
-        original_data_fig.add_trace(
-            go.Scatter(
-                x=od_df_update.index,
-                y=od_df_update[col],
-                mode='markers',
-                marker_size=5,
-                marker=dict(
-                    color=colors[index]
-                ),
-                name=col,
-                # for the tube name in the hover display
-                meta=col,
-                legendgroup=f"{col}",
-                # template for hover display
-                hovertemplate='Time: %{x}' +
-                              '<br>OD: %{y}<br>' +
-                              'Trace: %{meta}<br>' +
-                              '<extra></extra>'),
-            row=1,  # this is the top graph
-            col=1)
-        index += 1
-
-    index = 0
-    for col in od_df_update.columns:
-        original_data_fig.add_trace(
-            go.Scatter(
-                x=od_df_update.index,
-                y=np.log(od_df_update[col]),
-                mode='markers',
-                marker_size=5,
-                marker=dict(
-                    color=colors[index]
-                ),
-                name=f"{col} ln",
-                meta=f"{col} ln",
-                legendgroup=f"{col}",
-                hovertemplate='Time: %{x}' +
-                              '<br>ln OD: %{y}<br>' +
-                              'Trace: %{meta}<br>' +
-                              '<extra></extra>'
-            ),
-            row=2, # second graph
-            col=1
-        )
-        index += 1
+    for trace in tube_traces(od_df_update, colors, envelope=envelope if 'od' in envelope_modes else None):
+        original_data_fig.add_trace(trace, row=1, col=1)  # this is the top graph
+    for trace in tube_traces(od_df_update, colors, ln=True, envelope=envelope if 'ln' in envelope_modes else None):
+        original_data_fig.add_trace(trace, row=2, col=1)  # second graph
 
     # add the traces of the temperature
     for col in temp_df.columns:
@@ -698,37 +809,104 @@ def update_graph(od_df_update_store, tables_list, temp_df_store, device_num):
     return original_data_fig
 
 
+# callback for showing full resolution data when the main graph is zoomed in
+@app.callback(
+    Output('graph1', 'figure', allow_duplicate=True),
+    Input('graph1', 'relayoutData'),
+    State('od_df_original_full_store', 'data'),
+    State('od_df_update_store', 'data'),
+    State('table_store', 'data'),
+    State('IODR_store', 'data'),
+    State('envelope-checklist', 'value'),
+    prevent_initial_call=True
+)
+def zoom_main_graph(relayout_data, od_df_original_full_json, od_df_update_json, tables_list, device_num,
+                    envelope_modes):
+    if relayout_data is None or od_df_original_full_json is None or od_df_update_json is None:
+        return no_update
+
+    # the x-axes of the subplots are matched, so any of them can report the zoom
+    x_range = None
+    autorange = False
+    for key, value in relayout_data.items():
+        if key.startswith('xaxis') and key.endswith('.range[0]'):
+            x_range = [value, relayout_data[key.replace('[0]', '[1]')]]
+        elif key.startswith('xaxis') and key.endswith('.range'):
+            x_range = value
+        elif key.startswith('xaxis') and key.endswith('.autorange'):
+            autorange = True
+
+    envelope = None
+    stored_table_df = pd.read_json(tables_list[device_num], orient='table')
+    offsets = pd.to_numeric(stored_table_df['offset'], errors='coerce').fillna(0).to_numpy()
+    if autorange:
+        # zoomed back out, go back to the culled data and the bands of all the data, like update_graph
+        od_df_zoomed = pd.read_json(od_df_update_json, orient='table')
+        if envelope_modes:
+            od_df_original_full = pd.read_json(od_df_original_full_json, orient='table')
+            envelope = get_full_envelope(device_num, chIDs, od_df_original_full, offsets)
+    elif x_range is not None:
+        # the min and max points of each bucket of the channel's pyramid, or the full resolution data in the store when
+        # there is none
+        od_df_zoomed = get_pyramid_range(device_num, chIDs, x_range[0], x_range[1], cull_points)
+        if od_df_zoomed is None:
+            od_df_original_full = pd.read_json(od_df_original_full_json, orient='table')
+            od_df_zoomed = resample_range(od_df_original_full, x_range[0], x_range[1], cull_points)
+            if envelope_modes:
+                envelope = get_envelope(od_df_zoomed)
+        elif envelope_modes:
+            # the pyramid's min and max cover every point in the range
+            envelope = get_pyramid_range(device_num, chIDs, x_range[0], x_range[1], envelope=True)
+        # add the offset value for each column to the OD data, like update_table_df does
+        od_df_zoomed = od_df_zoomed + offsets[:len(od_df_zoomed.columns)]
+        if envelope is not None:
+            envelope = tuple(frame + offsets[:len(frame.columns)] for frame in envelope)
+    else:
+        return no_update
+
+    # only send the new points of the OD and ln OD traces, the layout (and so the zoom) stays as it is. The traces are
+    # made the same way as in update_graph so they line up with the ones in the figure
+    envelope_modes = envelope_modes or []
+    traces = tube_traces(od_df_zoomed, colors, envelope=envelope if 'od' in envelope_modes else None) + \
+        tube_traces(od_df_zoomed, colors, ln=True, envelope=envelope if 'ln' in envelope_modes else None)
+    patched_figure = Patch()
+    for i, trace in enumerate(traces):
+        patched_figure['data'][i]['x'] = trace.x
+        patched_figure['data'][i]['y'] = trace.y
+
+    return patched_figure
+
+
 # callback for the prediction graphs
 @app.callback(
     Output('linearODgraph', 'figure'),
     Input('tube-dropdown', 'value'),
-    Input('od_df_update_store', 'data'),
+    Input('od_df_update_store', 'data'),    # only redraws on new data, the fits use od_df_original_full_store
     Input('OD_target_slider', 'value'),
     Input('data-selection-slider', 'value'),
     Input('blank-val-input', 'value'),
     Input('table_store', 'data'),
+    Input('fit-method-radio', 'value'),
     State('zoom_vals_store', 'data'),
-    State('IODR_store', 'data')
+    State('IODR_store', 'data'),
+    State('od_df_original_full_store', 'data')
 )
 def update_predict_graphs(fit_tube, od_df_update_json, OD_target_slider, data_selection_slider, blank_value_input,
-                          tables_list, zoom_vals, device_num):
-    # read the dataframe in from the storage component
-    od_df_update = pd.read_json(od_df_update_json, orient='table')
+                          tables_list, fit_method, zoom_vals, device_num, od_df_original_full_json):
     stored_table_df = pd.read_json(tables_list[device_num], orient='table')
     names = stored_table_df['name'].tolist()
 
     blank_value_input = float(blank_value_input)
 
-    if fit_tube is not None:
-        # format the data into a dataframe of just the selected tube's OD and ln_od data
-        ln_od_df = format_ln_data(od_df_update, names.index(fit_tube), offset_value=float(blank_value_input))
-    else:
-        ln_od_df = format_ln_data(od_df_update, 0, offset_value=float(blank_value_input))
-
-    print("ln_od_df")
-    print(ln_od_df)
-    # use predict_curve function to predict the curve and get the last time point as a float
-    popt, last_time_point = predict_curve(ln_od_df, data_selection_slider)
+    # the selected tube's OD and ln_od data and the fit of the selected window with the last time point as a float.
+    # Both are kept between calls, so only a change of data, tube, window or offset fits again. They come from the
+    # full resolution data with the tube's table offset added (like the culled od_df_update_store has), since culling
+    # thins out older windows and changes their fits
+    tube_num = names.index(fit_tube) if fit_tube is not None else 0
+    table_offset = pd.to_numeric(stored_table_df['offset'], errors='coerce').fillna(0).iloc[tube_num]
+    ln_od_df, popt, last_time_point = get_window_fit(device_num, od_df_original_full_json, tube_num,
+                                                     data_selection_slider,
+                                                     offset_value=blank_value_input + table_offset, method=fit_method)
 
     # create scatter plot for ln data
 
@@ -811,7 +989,7 @@ def update_predict_graphs(fit_tube, od_df_update_json, OD_target_slider, data_se
 
         print("add predictions")
         # get where the ln curve intercepts the target line
-        intercept_x = (np.log(OD_target_slider) - popt[1]) / popt[0]  # need to fix!!!!
+        intercept_x = target_hours(popt, OD_target_slider)
         print(f"t predict")
         # create an np array for time coordinates
         t_predict = np.linspace((last_time_point + data_selection_slider[0]), intercept_x, 50)
@@ -822,8 +1000,8 @@ def update_predict_graphs(fit_tube, od_df_update_json, OD_target_slider, data_se
         # create array of y coordinates with linear curve calculated earlier
         y_predict = linear_curve(t_predict, popt[0], popt[1])
 
-        # change the time predict back to datatime objects
-        t_predict = (t_predict * pd.Timedelta(1, 'h')) + od_df_update.index[0]
+        # change the time predict back to datatime objects, the fit times are from the tube's first point
+        t_predict = (t_predict * pd.Timedelta(1, 'h')) + ln_od_df.index[0]
 
         r = round(popt[2], 3)
         print("R value:  ", r)
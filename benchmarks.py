@@ -0,0 +1,121 @@
+import io
+import os
+import time
+import resource
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import get_data_funs
+from get_data_funs import parse_feed, start_replay, stop_replay, sync_channel, cull_data
+from thingspeak_standin import make_feed_csv
+
+
+def legacy_parse(content):
+    """Returns the dataframe the way get_OD_dataframe used to parse the feed, for comparison
+
+    Arguments:
+
+    content -- bytes of a Thingspeak feed csv
+    """
+    df = pd.read_csv(io.StringIO(content.decode('utf-8')))
+    df2 = df.drop('entry_id', axis='columns')
+    df2['time'] = pd.to_datetime(df2['created_at']).dt.tz_convert('US/Eastern')
+    df3 = df2.drop('created_at', axis='columns')
+    df4 = df3.set_index('time')
+    return df4
+
+
+def time_function(function, argument, repeats):
+    """Returns the best time in seconds of calling function(argument) repeats times
+
+    Arguments:
+
+    function -- function to time
+
+    argument -- argument passed to the function
+
+    repeats -- number of calls
+    """
+    times = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        function(argument)
+        times.append(time.perf_counter() - start_time)
+    return min(times)
+
+
+def benchmark_parse(num_rows=8000, repeats=20):
+    """Prints the time to parse a feed of num_rows entries with the old parsing path and with parse_feed
+
+    Arguments:
+
+    num_rows -- number of entries in the feed (default 8000)
+
+    repeats -- number of times each parser is run, the best time is reported (default 20)
+    """
+    content = make_feed_csv(num_rows)
+
+    # both paths have to give the same data
+    legacy = legacy_parse(content)
+    fast = parse_feed(content).drop('entry_id', axis='columns')
+    assert np.allclose(legacy.to_numpy(dtype='f8'), fast.to_numpy(dtype='f8'), equal_nan=True)
+    assert (legacy.index == fast.index).all()
+
+    legacy_time = time_function(legacy_parse, content, repeats)
+    fast_time = time_function(parse_feed, content, repeats)
+    print(f"parse {num_rows} rows: legacy {legacy_time * 1000:.1f} ms, parse_feed {fast_time * 1000:.1f} ms, "
+          f"{legacy_time / fast_time:.1f}x faster")
+
+
+def benchmark_replay(csv_path=None, speed=1000, seconds=None, poll_seconds=1, chID=405675):
+    """Replays a recording at speed times real time and prints the latency of each incremental update (sync and
+    cull) with the number of held rows and the memory used, to see how the update path behaves as data piles up
+
+    Arguments:
+
+    csv_path -- recorded csv to replay (default None, a synthetic week of data)
+
+    speed -- replay speed, 1 to 1000 (default 1000)
+
+    seconds -- real seconds to run for (default None, until the whole recording is replayed, about 10 minutes for a
+    week at 1000x)
+
+    poll_seconds -- real seconds between updates (default 1)
+
+    chID -- channel ID to replay in place of (default IODR #1)
+    """
+    if csv_path is None:
+        # a week of entries 20 s apart
+        csv_path = os.path.join(tempfile.mkdtemp(), 'week.csv')
+        with open(csv_path, 'wb') as f:
+            f.write(make_feed_csv(num_rows=7 * 24 * 180))
+
+    start_replay(chID, csv_path, speed=speed)
+    recording = get_data_funs.replays[chID]['recording']
+    if seconds is None:
+        seconds = (recording.index[-1] - recording.index[0]).total_seconds() / speed + poll_seconds
+    try:
+        start_time = time.monotonic()
+        while time.monotonic() - start_time < seconds:
+            update_start = time.perf_counter()
+            held = sync_channel(chID, None)
+            if len(held) > 1:
+                cull_data(held.drop('entry_id', axis='columns').tail(get_data_funs.max_results))
+            update_time = time.perf_counter() - update_start
+
+            simulated_hours = (held.index[-1] - held.index[0]) / pd.Timedelta(1, 'h') if len(held) else 0
+            held_mb = held.memory_usage(deep=True).sum() / 1e6
+            # ru_maxrss is in kB on linux
+            max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+            print(f"{simulated_hours:7.1f} h simulated, {len(held):6d} rows held, update {update_time * 1000:6.1f} ms, "
+                  f"held {held_mb:6.1f} MB, max rss {max_rss_mb:6.0f} MB")
+            time.sleep(poll_seconds)
+    finally:
+        stop_replay(chID)
+
+
+if __name__ == '__main__':
+    benchmark_parse()
+    benchmark_replay(seconds=60)
@@ -0,0 +1,547 @@
+import numpy as np
+import pandas as pd
+
+# each pyramid level has buckets of pyramid_factor buckets of the level below. Levels stop being added once a level
+# has no more than pyramid_min_buckets buckets
+pyramid_factor = 4
+pyramid_min_buckets = 64
+# the statistics kept for each bucket of a pyramid level, t_min and t_max are the times of the min and max points
+level_keys = ('t', 't_sum', 'min', 'max', 'sum', 'count', 't_min', 't_max')
+time_keys = ('t', 't_min', 't_max')
+
+
+def lttb_indices(x, y, num_points):
+    """Returns a list with an array of selected row indices for each column of y, picked with the
+    Largest-Triangle-Three-Buckets algorithm. NaN values are skipped, so each column is downsampled from its own
+    points. All the columns are worked on at the same time, one bucket at a time
+
+    Arguments:
+
+    x -- 1d numpy array of x values (increasing)
+
+    y -- 2d numpy array of y values with one column per trace, can contain NaN
+
+    num_points -- number of points to keep per column (at least 3)
+    """
+    num_points = max(int(num_points), 3)
+    valid = [np.flatnonzero(~np.isnan(y[:, col])) for col in range(y.shape[1])]
+    selected = [rows for rows in valid]
+
+    # only the columns with more points than the budget need downsampling
+    cols = [col for col in range(y.shape[1]) if len(valid[col]) > num_points]
+    if len(cols) == 0:
+        return selected
+
+    counts = np.array([len(valid[col]) for col in cols])
+    width = counts.max()
+    # pad the columns to the same length with their last point, padding is never inside a bucket
+    rows = np.stack([np.pad(valid[col], (0, width - len(valid[col])), mode='edge') for col in cols])
+    xs = x[rows]
+    ys = y[rows, np.array(cols)[:, None]]
+    col_range = np.arange(len(cols))
+
+    # the first and last points are always kept, the points between go into num_points - 2 buckets
+    num_buckets = num_points - 2
+    edges = np.floor(np.linspace(1, counts - 1, num_buckets + 1, axis=1)).astype(int)
+
+    # average of the bucket after each bucket, from running sums. The last bucket uses the last point
+    x_sums = np.concatenate([np.zeros((len(cols), 1)), np.cumsum(xs, axis=1)], axis=1)
+    y_sums = np.concatenate([np.zeros((len(cols), 1)), np.cumsum(ys, axis=1)], axis=1)
+    next_lo = edges[:, 1:-1]
+    next_hi = edges[:, 2:]
+    next_counts = next_hi - next_lo
+    next_x = (np.take_along_axis(x_sums, next_hi, 1) - np.take_along_axis(x_sums, next_lo, 1)) / next_counts
+    next_y = (np.take_along_axis(y_sums, next_hi, 1) - np.take_along_axis(y_sums, next_lo, 1)) / next_counts
+    next_x = np.concatenate([next_x, xs[col_range, counts - 1][:, None]], axis=1)
+    next_y = np.concatenate([next_y, ys[col_range, counts - 1][:, None]], axis=1)
+
+    picks = np.zeros((len(cols), num_points), dtype=int)
+    picks[:, -1] = counts - 1
+    previous = np.zeros(len(cols), dtype=int)
+    for i in range(num_buckets):
+        lo = edges[:, i]
+        hi = edges[:, i + 1]
+        candidates = lo[:, None] + np.arange((hi - lo).max())
+        in_bucket = candidates < hi[:, None]
+        candidates = np.minimum(candidates, width - 1)
+
+        xa = xs[col_range, previous][:, None]
+        ya = ys[col_range, previous][:, None]
+        xb = np.take_along_axis(xs, candidates, 1)
+        yb = np.take_along_axis(ys, candidates, 1)
+        # twice the area of the triangle made by the previous pick, the candidate and the next bucket's average
+        area = np.abs((xa - next_x[:, i:i + 1]) * (yb - ya) - (xa - xb) * (next_y[:, i:i + 1] - ya))
+        area[~in_bucket] = -1
+
+        previous = candidates[col_range, np.argmax(area, axis=1)]
+        picks[:, i + 1] = previous
+
+    for j, col in enumerate(cols):
+        selected[col] = rows[j, picks[j]]
+    return selected
+
+
+def lttb_frame(dataframe, num_points):
+    """Returns a dataframe downsampled to at most num_points points per column with Largest-Triangle-Three-Buckets.
+    Rows are kept if any column picked them, and values a column didn't pick are set to NaN, so every trace plotted
+    from the result has at most num_points points
+
+    Arguments:
+
+    dataframe -- pandas dataframe with a time index and numeric columns
+
+    num_points -- number of points to keep per column
+    """
+    if len(dataframe) <= num_points:
+        return dataframe
+
+    values = dataframe.to_numpy(dtype='f8')
+    x = dataframe.index.to_numpy(dtype='datetime64[ns]').view('i8').astype('f8')
+    selected = lttb_indices(x, values, num_points)
+
+    keep = np.zeros(values.shape, dtype=bool)
+    for col, rows in enumerate(selected):
+        keep[rows, col] = True
+    keep_rows = keep.any(axis=1)
+
+    culled = np.where(keep, values, np.nan)[keep_rows]
+    return pd.DataFrame(culled, index=dataframe.index[keep_rows], columns=dataframe.columns)
+
+
+def resample_range(dataframe, start, end, num_points):
+    """Returns the part of a dataframe between start and end, downsampled to num_points points per column with
+    lttb_frame. Used to show full resolution detail when a graph is zoomed in
+
+    Arguments:
+
+    dataframe -- pandas dataframe with a time index
+
+    start -- start of the range, a time string or Timestamp. Times without a timezone are compared with the wall
+    time of the index, which is how plotly reports the axis range
+
+    end -- end of the range, same format as start
+
+    num_points -- number of points to keep per column
+    """
+    start = pd.Timestamp(start)
+    end = pd.Timestamp(end)
+    index = dataframe.index
+    if index.tz is not None and start.tzinfo is None:
+        index = index.tz_localize(None)
+    visible = dataframe.loc[(index >= start) & (index <= end)]
+    return lttb_frame(visible, num_points)
+
+
+def time_buckets(dataframe, bucket):
+    """Returns a dataframe with the mean of each column in each time bucket of a fixed length. NaN values are skipped,
+    so each tube is averaged from its own readings, and buckets where no column has a reading are left out. Each row
+    is placed at the mean time of the rows in its bucket
+
+    Arguments:
+
+    dataframe -- pandas dataframe with a time index and numeric columns
+
+    bucket -- length of a bucket, a Timedelta or string like '10min'
+    """
+    if len(dataframe) == 0:
+        return dataframe
+
+    values = dataframe.to_numpy(dtype='f8')
+    x = dataframe.index.to_numpy(dtype='datetime64[ns]').view('i8')
+    # buckets line up with the epoch (UTC), so they don't move as new rows arrive
+    keys = x // pd.Timedelta(bucket).value
+    starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+
+    valid = ~np.isnan(values)
+    counts = np.add.reduceat(valid, starts, axis=0)
+    sums = np.add.reduceat(np.where(valid, values, 0), starts, axis=0)
+    with np.errstate(invalid='ignore'):
+        means = sums / counts
+    rows_per_bucket = np.diff(np.append(starts, len(x)))
+    times = (np.add.reduceat(x.astype('f8'), starts) / rows_per_bucket).astype('i8')
+
+    keep = counts.any(axis=1)
+    index = pd.DatetimeIndex(times[keep].astype('datetime64[ns]'), name=dataframe.index.name)
+    if dataframe.index.tz is not None:
+        index = index.tz_localize('UTC').tz_convert(dataframe.index.tz)
+    return pd.DataFrame(means[keep], index=index, columns=dataframe.columns)
+
+
+def time_decimate(dataframe, tiers):
+    """Returns a dataframe thinned by the age of each row: every tier covers the rows up to a number of hours older
+    than the last row, and averages them into time buckets of its own length (see time_buckets) or keeps them as
+    they are. The time resolution of the result doesn't depend on how many rows or NaN readings the feed has
+
+    Arguments:
+
+    dataframe -- pandas dataframe with a time index and numeric columns
+
+    tiers -- list of (hours, bucket) from the newest tier to the oldest. hours is the age the tier reaches back to
+    (None for everything older), bucket a Timedelta or string like '10min' (None for full resolution). For example
+    [(2, None), (24, '1min'), (None, '10min')]
+    """
+    if len(dataframe) == 0:
+        return dataframe
+
+    end = dataframe.index[-1]
+    pieces = []
+    newer_cutoff = None
+    for hours, bucket in tiers:
+        cutoff = end - pd.Timedelta(hours, 'h') if hours is not None else None
+        rows = dataframe
+        if cutoff is not None:
+            rows = rows.loc[rows.index > cutoff]
+        if newer_cutoff is not None:
+            rows = rows.loc[rows.index <= newer_cutoff]
+        pieces.insert(0, rows if bucket is None else time_buckets(rows, bucket))
+        if cutoff is None or cutoff <= dataframe.index[0]:
+            break
+        newer_cutoff = cutoff
+    return pd.concat(pieces)
+
+
+def envelope_frames(dataframe, num_buckets):
+    """Returns a tuple of dataframes (min, max, mean) with one row per time bucket, for drawing each column as a
+    band between its min and max with a line through its mean. The time range is split into num_buckets equal
+    buckets and every column is reduced at the same time. NaN values are skipped, so each column gets the min, max and
+    mean of its own points, and is NaN in buckets where it has none
+
+    Arguments:
+
+    dataframe -- pandas dataframe with a time index and numeric columns
+
+    num_buckets -- number of time buckets
+    """
+    if len(dataframe) == 0:
+        return dataframe, dataframe, dataframe
+
+    values = dataframe.to_numpy(dtype='f8')
+    x = dataframe.index.to_numpy(dtype='datetime64[ns]').view('i8')
+    # first row of each bucket, buckets without rows are left out
+    edges = np.linspace(x[0], x[-1], max(int(num_buckets), 1) + 1)[:-1]
+    starts = np.unique(np.searchsorted(x, edges, side='left'))
+
+    valid = ~np.isnan(values)
+    # fmin and fmax skip NaN unless the whole bucket is NaN
+    mins = np.fmin.reduceat(values, starts, axis=0)
+    maxs = np.fmax.reduceat(values, starts, axis=0)
+    counts = np.add.reduceat(valid, starts, axis=0)
+    sums = np.add.reduceat(np.where(valid, values, 0), starts, axis=0)
+    with np.errstate(invalid='ignore'):
+        means = sums / counts
+
+    # each bucket is placed at the mean time of its rows
+    rows_per_bucket = np.diff(np.append(starts, len(x)))
+    times = (np.add.reduceat(x.astype('f8'), starts) / rows_per_bucket).astype('i8')
+    index = pd.DatetimeIndex(times.astype('datetime64[ns]'), name=dataframe.index.name)
+    if dataframe.index.tz is not None:
+        index = index.tz_localize('UTC').tz_convert(dataframe.index.tz)
+
+    return tuple(pd.DataFrame(stat, index=index, columns=dataframe.columns) for stat in (mins, maxs, means))
+
+
+def new_pyramid_level():
+    """Returns an empty pyramid level: per bucket the first time, summed time (both ns), min, max, sum, count and the
+    times of the min and max (ns). Each statistic is a view of the used part (lo to hi) of a buffer that grows by
+    doubling"""
+    level = {
+        'buffers': {key: np.zeros(0, dtype='i8' if key in time_keys else 'f8') for key in level_keys},
+        'lo': 0,
+        'hi': 0
+    }
+    refresh_level(level)
+    return level
+
+
+def refresh_level(level):
+    """Points the statistics of a pyramid level at the used part of its buffers
+
+    Arguments:
+
+    level -- pyramid level from new_pyramid_level
+    """
+    for key in level_keys:
+        level[key] = level['buffers'][key][level['lo']:level['hi']]
+
+
+def set_level_buckets(level, start, new_buckets):
+    """Replaces the buckets of a pyramid level from start on with new buckets. The buffers are only reallocated when
+    they are full, to twice the size that is needed, so adding buckets one sync at a time is amortized O(1) per bucket
+
+    Arguments:
+
+    level -- pyramid level from new_pyramid_level
+
+    start -- index of the first bucket to replace (at most the number of buckets)
+
+    new_buckets -- dict of arrays with the statistics of the new buckets
+    """
+    needed = start + len(new_buckets['t'])
+    buffers = level['buffers']
+    if level['lo'] + needed > len(buffers['t']):
+        # move the kept buckets to the front of bigger buffers, which also frees the space of trimmed buckets
+        capacity = max(2 * needed, pyramid_min_buckets)
+        for key in level_keys:
+            grown = np.zeros(capacity, dtype=buffers[key].dtype)
+            grown[:start] = buffers[key][level['lo']:level['lo'] + start]
+            buffers[key] = grown
+        level['lo'] = 0
+    for key in level_keys:
+        buffers[key][level['lo'] + start:level['lo'] + needed] = new_buckets[key]
+    level['hi'] = level['lo'] + needed
+    refresh_level(level)
+
+
+def segment_extreme_times(values, times, starts, extremes):
+    """Returns the time of the first point of each segment of values that is equal to the segment's extreme, where the
+    segments start at starts and the last one runs to the end
+
+    Arguments:
+
+    values -- numpy array of values
+
+    times -- numpy array of the times of the values
+
+    starts -- sorted numpy array of the first index of each segment
+
+    extremes -- numpy array of the min (or max) of each segment, from np.minimum.reduceat (or maximum)
+    """
+    lengths = np.diff(np.append(starts, len(values)))
+    hits = np.flatnonzero(values[starts[0]:] == np.repeat(extremes, lengths)) + starts[0]
+    # every segment has at least one hit and the hits are in order, so keep the first hit of each segment
+    segments = np.searchsorted(starts, hits, side='right') - 1
+    return times[hits[np.flatnonzero(np.diff(segments, prepend=-1))]]
+
+
+def extend_level(levels, level_num, first_changed):
+    """Recomputes the buckets of a pyramid level made from the buckets of the level below starting at first_changed,
+    then moves on to the next level up. Only the last partial bucket and the new buckets are recomputed
+
+    Arguments:
+
+    levels -- list of levels of one column
+
+    level_num -- number of the level to update (at least 1)
+
+    first_changed -- index of the first bucket of the level below that changed
+    """
+    below = levels[level_num - 1]
+    num_below = len(below['t'])
+    if num_below <= pyramid_min_buckets and level_num >= len(levels):
+        return
+    if level_num >= len(levels):
+        levels.append(new_pyramid_level())
+    level = levels[level_num]
+
+    # the first bucket of this level that includes a changed bucket of the level below. A level that was just added
+    # is filled from the start
+    start = min(first_changed // pyramid_factor, len(level['t']))
+    starts = np.arange(start * pyramid_factor, num_below, pyramid_factor)
+    if len(starts) != 0:
+        new_buckets = {
+            't': below['t'][starts],
+            't_sum': np.add.reduceat(below['t_sum'], starts),
+            'min': np.minimum.reduceat(below['min'], starts),
+            'max': np.maximum.reduceat(below['max'], starts),
+            'sum': np.add.reduceat(below['sum'], starts),
+            'count': np.add.reduceat(below['count'], starts)
+        }
+        new_buckets['t_min'] = segment_extreme_times(below['min'], below['t_min'], starts, new_buckets['min'])
+        new_buckets['t_max'] = segment_extreme_times(below['max'], below['t_max'], starts, new_buckets['max'])
+        set_level_buckets(level, start, new_buckets)
+
+    extend_level(levels, level_num + 1, start)
+
+
+def extend_pyramid(pyramid, dataframe):
+    """Adds the rows of a dataframe newer than the last row already in a pyramid. Each column's points are added to
+    its raw level and only the buckets above them are recomputed
+
+    Arguments:
+
+    pyramid -- pyramid from build_pyramid
+
+    dataframe -- pandas dataframe with a time index and the pyramid's columns
+    """
+    times = dataframe.index.to_numpy(dtype='datetime64[ns]').view('i8')
+    new = times > pyramid['last_time']
+    if not new.any():
+        return pyramid
+    times = times[new]
+
+    for col in pyramid['columns']:
+        values = dataframe[col].to_numpy(dtype='f8')[new] if col in dataframe.columns else np.zeros(0)
+        valid = ~np.isnan(values)
+        levels = pyramid['levels'][col]
+        first_changed = len(levels[0]['t'])
+        set_level_buckets(levels[0], first_changed, {
+            't': times[valid],
+            't_sum': times[valid].astype('f8'),
+            'min': values[valid],
+            'max': values[valid],
+            'sum': values[valid],
+            'count': np.ones(valid.sum()),
+            't_min': times[valid],
+            't_max': times[valid]
+        })
+        extend_level(levels, 1, first_changed)
+
+    pyramid['last_time'] = times[-1]
+    return pyramid
+
+
+def trim_pyramid(pyramid, first_time):
+    """Drops the oldest points of a pyramid that are before first_time, so the pyramid doesn't keep growing after the
+    rows are no longer held. Whole buckets of the top level are dropped with the buckets and points under them, so
+    every level keeps its buckets lined up with the level below. Points in the top level's first bucket that is not
+    entirely before first_time are kept
+
+    Arguments:
+
+    pyramid -- pyramid from build_pyramid
+
+    first_time -- time in ns since the epoch of the oldest row to keep
+    """
+    for col in pyramid['columns']:
+        levels = pyramid['levels'][col]
+        top_num = len(levels) - 1
+        # a bucket is entirely before first_time when the next bucket starts at or before it
+        num_dropped = max(np.searchsorted(levels[-1]['t'], first_time, side='right') - 1, 0)
+        if num_dropped == 0:
+            continue
+        for level_num, level in enumerate(levels):
+            level['lo'] += num_dropped * pyramid_factor ** (top_num - level_num)
+            refresh_level(level)
+    pyramid['first_time'] = max(pyramid['first_time'], first_time)
+    return pyramid
+
+
+def build_pyramid(dataframe):
+    """Returns a level of detail pyramid of a dataframe. Every column gets a raw level with each of its points, then
+    levels with buckets of 4, 16, 64... points holding the min, max and mean of each bucket. NaN values are skipped,
+    so each column is bucketed from its own points
+
+    Arguments:
+
+    dataframe -- pandas dataframe with a time index and numeric columns (entry_id is skipped)
+    """
+    columns = [col for col in dataframe.columns if col != 'entry_id']
+    pyramid = {
+        'columns': columns,
+        'levels': {col: [new_pyramid_level()] for col in columns},
+        'first_time': dataframe.index[0].value if len(dataframe) != 0 else np.iinfo('i8').max,
+        'last_time': np.iinfo('i8').min
+    }
+    return extend_pyramid(pyramid, dataframe)
+
+
+def query_pyramid(pyramid, start=None, end=None, num_points=500):
+    """Returns a dict with the bucket times, mean, min and max arrays and the times of the min and max (time_min and
+    time_max) of each column between start and end, taken from the finest level that has at most num_points buckets in
+    the range. Only the returned buckets are touched, so the cost depends on num_points and not on how much data is in
+    the pyramid
+
+    Arguments:
+
+    pyramid -- pyramid from build_pyramid
+
+    start -- timezone aware Timestamp for the start of the range (default None, from the beginning)
+
+    end -- timezone aware Timestamp for the end of the range (default None, to the end)
+
+    num_points -- most buckets to return per column (default 500)
+    """
+    start_ns = pd.Timestamp(start).value if start is not None else np.iinfo('i8').min
+    end_ns = pd.Timestamp(end).value if end is not None else np.iinfo('i8').max
+
+    result = {}
+    for col in pyramid['columns']:
+        levels = pyramid['levels'][col]
+        for level in levels:
+            lo = np.searchsorted(level['t'], start_ns, side='left')
+            hi = np.searchsorted(level['t'], end_ns, side='right')
+            if hi - lo <= num_points or level is levels[-1]:
+                break
+        count = level['count'][lo:hi]
+        result[col] = {
+            'time': (level['t_sum'][lo:hi] / np.maximum(count, 1)).astype('i8'),
+            'mean': level['sum'][lo:hi] / np.maximum(count, 1),
+            'min': level['min'][lo:hi].copy(),
+            'max': level['max'][lo:hi].copy(),
+            'time_min': level['t_min'][lo:hi].copy(),
+            'time_max': level['t_max'][lo:hi].copy()
+        }
+    return result
+
+
+def buckets_to_frame(buckets, columns, stat, tz):
+    """Returns a dataframe with one column per pyramid column of one statistic of the buckets from query_pyramid, on
+    the union of the bucket times with NaN where a column has no bucket
+
+    Arguments:
+
+    buckets -- dict from query_pyramid
+
+    columns -- list of the pyramid's columns
+
+    stat -- 'mean', 'min' or 'max' (or any other key of the buckets with one value per time)
+
+    tz -- timezone of the returned index
+    """
+    series = []
+    for col in columns:
+        column = pd.Series(buckets[col][stat], index=buckets[col]['time'], name=col)
+        series.append(column[~column.index.duplicated()])
+    frame = pd.concat(series, axis=1).sort_index() if series else pd.DataFrame()
+    frame.index = pd.to_datetime(frame.index.to_numpy(dtype='i8'), utc=True).tz_convert(tz).rename('time')
+    return frame
+
+
+def pyramid_frame(pyramid, start=None, end=None, num_points=500, tz='US/Eastern'):
+    """Returns a dataframe in the same shape as cull_data (time index, one column per trace with NaN where a trace has
+    no point) with the min and max point of each bucket from query_pyramid at their own times (M4 style), so spikes
+    and extremes stay in the graph at every zoom level. Buckets of single points give one point
+
+    Arguments:
+
+    pyramid -- pyramid from build_pyramid
+
+    start -- timezone aware Timestamp for the start of the range (default None, from the beginning)
+
+    end -- timezone aware Timestamp for the end of the range (default None, to the end)
+
+    num_points -- most points per column (default 500)
+
+    tz -- timezone of the returned index (default 'US/Eastern')
+    """
+    # two points per bucket
+    buckets = query_pyramid(pyramid, start, end, max(num_points // 2, 1))
+    points = {}
+    for col in pyramid['columns']:
+        times = np.concatenate([buckets[col]['time_min'], buckets[col]['time_max']])
+        order = np.argsort(times, kind='stable')
+        points[col] = {
+            'time': times[order],
+            'point': np.concatenate([buckets[col]['min'], buckets[col]['max']])[order]
+        }
+    return buckets_to_frame(points, pyramid['columns'], 'point', tz)
+
+
+def pyramid_envelope(pyramid, start=None, end=None, num_points=500, tz='US/Eastern'):
+    """Returns a tuple of dataframes (min, max, mean) in the shape of envelope_frames with the buckets from
+    query_pyramid, so the band covers every stored point and not just the points that were kept for the graph
+
+    Arguments:
+
+    pyramid -- pyramid from build_pyramid
+
+    start -- timezone aware Timestamp for the start of the range (default None, from the beginning)
+
+    end -- timezone aware Timestamp for the end of the range (default None, to the end)
+
+    num_points -- most buckets per column (default 500)
+
+    tz -- timezone of the returned index (default 'US/Eastern')
+    """
+    buckets = query_pyramid(pyramid, start, end, num_points)
+    return tuple(buckets_to_frame(buckets, pyramid['columns'], stat, tz) for stat in ('min', 'max', 'mean'))
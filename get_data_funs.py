@@ -14,14 +14,878 @@ import plotly.express as px
 from rq import Queue
 from worker import conn
 
+import os
 import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from scipy.signal import find_peaks
 from scipy.optimize import curve_fit
 from scipy.stats import linregress
 from scipy import stats
 
+from downsample_funs import lttb_indices, lttb_frame, resample_range, time_decimate, envelope_frames, build_pyramid, extend_pyramid, \
+    trim_pyramid, pyramid_frame, pyramid_envelope
+from store_funs import store_frame, read_store_range, read_store_tail, sync_file_lock, mark_synced, get_synced_age
 
-def get_OD_dataframe(device, chIDs, readAPIkeys):
+logger = logging.getLogger(__name__)
+
+# dataframes held in memory for each Thingspeak channel, keyed by channel ID. These keep the entry_id column so that
+# only entries after the last one we have need to be requested on the next sync
+held_frames = {}
+# level of detail pyramids of the held data of each channel, keyed by channel ID. Kept up to date by set_held_frame
+# so a zoomed in range can be drawn without going through every held row
+pyramids = {}
+# functions called with (chID, new_rows) when rows are appended to a held channel, with the channels they watch
+# (None for every channel). Added with add_append_listener
+append_listeners = []
+# one lock per channel so two callbacks don't sync the same channel at the same time
+channel_locks = {}
+channel_locks_lock = threading.Lock()
+
+# syncs running in this process, keyed by channel ID. Other threads asking for the same channel wait for these
+in_flight = {}
+in_flight_lock = threading.Lock()
+# seconds a sync by another gunicorn worker counts as fresh, its rows are read from the store instead of Thingspeak
+shared_sync_seconds = 10
+
+# thread pool used to download the OD channel and the temperature channel at the same time
+fetch_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='thingspeak-fetch')
+
+# format of the created_at column in Thingspeak csv feeds, without the ' UTC' at the end
+ts_time_format = '%Y-%m-%d %H:%M:%S'
+
+# number of rows a full Thingspeak request returns, and the number of rows handed to the graphs
+max_results = 8000
+# points per trace that cull_data keeps for the graphs
+cull_points = 500
+# hours of the newest data that the 'lttb' mode of cull_data keeps at full resolution, since the table estimates and
+# the prediction graphs fit the culled data over the last hours
+cull_recent_hours = 2
+# how cull_data thins the data: 'lttb' keeps cull_points points per trace, 'time' averages by the age of the data
+# into the buckets of time_tiers
+cull_mode = 'lttb'
+# (hours, bucket) tiers for the 'time' mode, newest first: full resolution for the last 2 hours, 1 minute buckets
+# back to 24 hours, 10 minute buckets before that (see downsample_funs.time_decimate)
+time_tiers = [(2, None), (24, '1min'), (None, '10min')]
+# time buckets per tube when the main graph shows min/max envelopes instead of points
+envelope_buckets = 200
+# upper limit on rows held in memory per channel, the oldest rows are dropped past this
+max_held_rows = 100000
+
+# settings for the tiered fetch: hours of full resolution data, then older history aggregated by Thingspeak into
+# buckets of tier_timescale minutes going back tier_history_days
+tier_recent_hours = 2
+tier_timescale = 10
+tier_history_days = 2
+tier_aggregate = 'average'
+# bucket sizes in minutes that Thingspeak accepts for average=, median= and timescale=
+ts_timescales = [10, 15, 20, 30, 60, 240, 720, 1440]
+
+# a held channel younger than fresh_seconds is served as is. Older than that it is served right away while it is
+# revalidated in the background, until it is older than its max stale seconds and has to be synced before returning
+fresh_seconds = 5
+default_max_stale = 120
+# max stale seconds for single channels, keyed by channel ID, channels not listed use default_max_stale
+channel_max_stale = {}
+# monotonic time each channel was last synced by this process
+synced_at = {}
+# ETag/Last-Modified validators of the last entry of each channel, sent back to let Thingspeak answer 304
+last_entry_validators = {}
+# background revalidations, kept separate from fetch_pool so they never hold up a device switch
+revalidate_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='thingspeak-revalidate')
+
+# time index and the six temperature fields of the temperature channel, shared by all three devices
+temp_cache = {'frame': None, 'index': None, 'values': None}
+temp_cache_lock = threading.Lock()
+
+# recorded data replayed in place of Thingspeak channels, keyed by channel ID
+replays = {}
+
+# frames and store jsons of each device kept ready by the pre-warm poller, keyed by device number
+prewarmed = {}
+prewarm_stop = threading.Event()
+prewarm_thread = None
+
+# hours of history requested per backfill page, and how many pages are downloaded at once
+backfill_page_hours = 24
+backfill_workers = 4
+# earliest time each channel has been backfilled from, so empty history isn't requested again
+backfilled_from = {}
+
+
+# url the Thingspeak channels API is under. Point it at the local stand-in server (thingspeak_standin.py) to work
+# offline
+ts_base_url = os.getenv('THINGSPEAK_BASE_URL', 'https://api.thingspeak.com/channels')
+
+# (connect, read) timeouts in seconds for every Thingspeak request, so a hung request can't hold a worker forever
+request_timeout = (3.05, 8)
+# a request and its retries are given up on after request_deadline seconds in all, so a sync's last.json and feed
+# requests together stay under gunicorn's 30 s worker timeout. Connection errors, timeouts and busy/server error
+# responses are retried up to request_retries times, waiting 0.5 s, 1 s... between attempts
+request_deadline = 12
+request_retries = 2
+retry_statuses = {429, 500, 502, 503, 504}
+# timing counters for the Thingspeak requests made by this process
+request_stats = {'requests': 0, 'errors': 0, 'bytes': 0, 'total_seconds': 0.0, 'max_seconds': 0.0}
+# url, status code, seconds and bytes of the most recent requests
+recent_requests = deque(maxlen=100)
+request_stats_lock = threading.Lock()
+
+
+def set_base_url(base_url):
+    """Sets the url the Thingspeak channels API is under
+
+    Arguments:
+
+    base_url -- url without a trailing slash, for example https://api.thingspeak.com/channels
+    """
+    global ts_base_url
+    ts_base_url = base_url.rstrip('/')
+
+
+def channel_url(chID, path):
+    """Returns the url of a Thingspeak channel endpoint
+
+    Arguments:
+
+    chID -- Thingspeak channel ID
+
+    path -- endpoint under the channel, for example 'feeds.csv'
+    """
+    return f'{ts_base_url}/{chID}/{path}'
+
+
+def make_session():
+    """Returns a requests Session with pooled keep-alive connections and gzip transfer for talking to Thingspeak.
+    Requests are retried by ts_get, which keeps the retries within request_deadline
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=10)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+    return session
+
+
+# shared client used by every function that gets data from Thingspeak
+ts_session = make_session()
+
+
+def ts_get(url, params=None, headers=None):
+    """Returns the response of a GET request made with the shared Thingspeak session. Connection errors, timeouts and
+    busy/server error responses are retried with exponential backoff, but every attempt is cut short at
+    request_deadline seconds after the first one started. Raises a requests exception if the request fails or comes
+    back with an error status
+
+    Arguments:
+
+    url -- url to request
+
+    params -- dict of query parameters (default None)
+
+    headers -- dict of extra request headers (default None)
+    """
+    start_time = time.perf_counter()
+    deadline = start_time + request_deadline
+    status = None
+    num_bytes = 0
+    try:
+        for attempt in range(request_retries + 1):
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise requests.Timeout(f"no response from {url} within {request_deadline} s")
+            retry = attempt < request_retries
+            try:
+                r = ts_session.get(url, params=params, headers=headers,
+                                   timeout=(min(request_timeout[0], remaining), min(request_timeout[1], remaining)))
+            except (requests.ConnectionError, requests.Timeout):
+                if not retry:
+                    raise
+            else:
+                status = r.status_code
+                num_bytes += len(r.content)
+                if status not in retry_statuses or not retry:
+                    break
+            # back off, but not past the deadline
+            time.sleep(min(0.5 * 2 ** attempt, max(deadline - time.perf_counter(), 0)))
+        r.raise_for_status()
+        return r
+    except requests.RequestException:
+        with request_stats_lock:
+            request_stats['errors'] += 1
+        raise
+    finally:
+        elapsed = time.perf_counter() - start_time
+        with request_stats_lock:
+            request_stats['requests'] += 1
+            request_stats['bytes'] += num_bytes
+            request_stats['total_seconds'] += elapsed
+            request_stats['max_seconds'] = max(request_stats['max_seconds'], elapsed)
+            recent_requests.append({'url': url, 'status': status, 'seconds': elapsed, 'bytes': num_bytes})
+
+
+def get_request_stats():
+    """Returns a dict with the request counters of the Thingspeak client and a list of the most recent requests"""
+    with request_stats_lock:
+        stats = dict(request_stats)
+        stats['recent'] = list(recent_requests)
+    stats['mean_seconds'] = stats['total_seconds'] / stats['requests'] if stats['requests'] else 0.0
+    return stats
+
+
+def get_channel_lock(chID):
+    """Returns the lock used to guard syncing of a channel, creating it if needed
+
+    Arguments:
+
+    chID -- Thingspeak channel ID
+    """
+    with channel_locks_lock:
+        if chID not in channel_locks:
+            channel_locks[chID] = threading.Lock()
+        return channel_locks[chID]
+
+
+def ts_time(timestamp):
+    """Returns a timestamp as a UTC string in the format used by the Thingspeak start= and end= parameters
+
+    Arguments:
+
+    timestamp -- timezone aware pandas Timestamp
+    """
+    return timestamp.tz_convert('UTC').strftime(ts_time_format)
+
+
+def parse_feed(content, field_dtype='f8', entry_id_dtype='i8'):
+    """Returns a dataframe of a Thingspeak feed csv with the time (US/Eastern) as the index. The entry_id column is kept.
+    The csv is read straight from the response bytes with the column types given up front, and the time index is
+    built in place without making intermediate dataframes
+
+    Arguments:
+
+    content -- bytes of the csv returned by the Thingspeak feeds endpoint
+
+    field_dtype -- numpy dtype of the field columns (default 'f8')
+
+    entry_id_dtype -- numpy dtype of the entry_id column, averaged feeds have no entry_id so need 'f8' (default 'i8')
+    """
+    # the header is the first line, use it to give every field column its type so pandas doesn't have to guess
+    header = content[:content.find(b'\n')].decode('utf-8').strip().split(',')
+    dtypes = {col: field_dtype for col in header if col.startswith('field')}
+    dtypes['entry_id'] = entry_id_dtype
+
+    df = pd.read_csv(io.BytesIO(content), dtype=dtypes, index_col='created_at')
+
+    # convert time string to datetime, and switch from UTC to Eastern time
+    try:
+        # cutting off the ' UTC' suffix lets pandas use its fast ISO 8601 parser
+        time_index = pd.to_datetime(df.index.str.slice(0, 19), format=ts_time_format).tz_localize('UTC')
+    except (ValueError, AttributeError):
+        time_index = pd.to_datetime(df.index, utc=True)
+    df.index = time_index.tz_convert('US/Eastern').rename('time')
+
+    return df
+
+
+def append_rows(held, new_rows):
+    """Returns a new dataframe with the rows of new_rows that come after the last entry_id of held appended to it
+
+    Arguments:
+
+    held -- dataframe currently held for the channel (can be None)
+
+    new_rows -- dataframe from parse_feed with the newly downloaded entries
+    """
+    if held is None or len(held) == 0:
+        return new_rows
+    # the start= parameter is inclusive, so the last held entry comes back again
+    new_rows = new_rows.loc[new_rows['entry_id'] > held['entry_id'].iloc[-1]]
+    if len(new_rows) == 0:
+        return held
+    return pd.concat([held, new_rows]).tail(max_held_rows)
+
+
+def set_held_frame(chID, held):
+    """Holds a dataframe for a channel and brings the channel's pyramid up to date. New rows are added to the pyramid,
+    and it is rebuilt when older history was added in front of it. Rows dropped from the front of the held dataframe
+    are trimmed from the pyramid too, so it stays about as big as the held dataframe. Call with the channel lock held
+
+    Arguments:
+
+    chID -- Thingspeak channel ID
+
+    held -- dataframe with the time as the index and an entry_id column
+    """
+    previous = held_frames.get(chID)
+    held_frames[chID] = held
+    if held is None or len(held) == 0:
+        pyramids.pop(chID, None)
+        return
+    notify_append_listeners(chID, previous, held)
+    pyramid = pyramids.get(chID)
+    if pyramid is None or held.index[0].value < pyramid['first_time']:
+        pyramids[chID] = build_pyramid(held)
+    else:
+        # only the rows after the last one in the pyramid are handed over
+        last_time = pd.Timestamp(pyramid['last_time'], tz='UTC')
+        extend_pyramid(pyramid, held.iloc[held.index.searchsorted(last_time, side='right'):])
+        trim_pyramid(pyramid, held.index[0].value)
+
+
+def add_append_listener(function, chIDs=None):
+    """Registers a function to call with (chID, new_rows) whenever rows are appended to a held channel. It is called
+    with the channel lock held, so it should be quick
+
+    Arguments:
+
+    function -- function taking the channel ID and a dataframe of the new rows (time index, entry_id and field
+    columns)
+
+    chIDs -- list of channel IDs to watch (default None, every channel)
+    """
+    append_listeners.append((function, None if chIDs is None else set(chIDs)))
+
+
+def notify_append_listeners(chID, previous, held):
+    """Calls the append listeners of a channel with the rows of held after the last entry of previous. Rows added in
+    front of the held data by a backfill aren't passed on. A failing listener is logged and otherwise ignored
+
+    Arguments:
+
+    chID -- Thingspeak channel ID
+
+    previous -- dataframe held for the channel before (can be None)
+
+    held -- dataframe held for the channel now
+    """
+    if len(append_listeners) == 0:
+        return
+    if previous is None or len(previous) == 0:
+        new_rows = held
+    else:
+        new_rows = held.iloc[held['entry_id'].searchsorted(previous['entry_id'].iloc[-1], side='right'):]
+    if len(new_rows) == 0:
+        return
+    for function, watched in append_listeners:
+        if watched is not None and chID not in watched:
+            continue
+        try:
+            function(chID, new_rows)
+        except Exception:
+            logger.warning("append listener %s failed for channel %s", function.__name__, chID, exc_info=True)
+
+
+def drop_held_frame(chID):
+    """Stops holding the dataframe and pyramid of a channel
+
+    Arguments:
+
+    chID -- Thingspeak channel ID
+    """
+    held_frames.pop(chID, None)
+    pyramids.pop(chID, None)
+
+
+def load_stored(chID):
+    """Returns the most recent 8000 rows saved on disk for a channel, or None if there are none or the store can't
+    be read
+
+    Arguments:
+
+    chID -- Thingspeak channel ID
+    """
+    try:
+        return read_store_tail(chID, max_results)
+    except (OSError, ValueError):
+        logger.warning("could not read stored history of channel %s", chID, exc_info=True)
+        return None
+
+
+def save_rows(chID, new_rows):
+    """Saves newly downloaded rows of a channel to disk and returns True if they were saved. A failed write is logged
+    and otherwise ignored, since the data is still held in memory
+
+    Arguments:
+
+    chID -- Thingspeak channel ID
+
+    new_rows -- dataframe from parse_feed
+    """
+    try:
+        store_frame(chID, new_rows)
+    except OSError:
+        logger.warning("could not save history of channel %s", chID, exc_info=True)
+        return False
+    return True
+
+
+def single_flight(key, function, *args):
+    """Returns function(*args). If another thread is already running a call with the same key, waits for that call
+    and returns its result instead of calling the function again
+
+    Arguments:
+
+    key -- hashable key identifying the call
+
+    function -- function to call
+
+    args -- arguments of the function
+    """
+    with in_flight_lock:
+        future = in_flight.get(key)
+        is_owner = future is None
+        if is_owner:
+            future = Future()
+            in_flight[key] = future
+
+    if not is_owner:
+        return future.result()
+
+    try:
+        result = function(*args)
+    except BaseException as error:
+        future.set_exception(error)
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        with in_flight_lock:
+            del in_flight[key]
+
+
+def sync_channel(chID, readAPIkey):
+    """Returns the held dataframe for a channel after downloading only the entries newer than the last held entry_id.
+    The first call for a channel downloads the last 8000 entries. Threads asking for the same channel at the same
+    time share one sync, and gunicorn workers share syncs through the store
+
+    Arguments:
+
+    chID -- Thingspeak channel ID
+
+    readAPIkey -- read API key of the channel
+    """
+    if chID in replays:
+        return single_flight(('sync', chID), sync_replay, chID)
+    return single_flight(('sync', chID), sync_channel_shared, chID, readAPIkey)
+
+
+def start_replay(chID, csv_path, speed=1, start_hours=0):
+    """Replays a recorded csv in place of a Thingspeak channel, as if its rows were arriving live. Rows show up once
+    their recorded time has passed on a clock running speed times faster than real time. Replayed rows aren't saved
+    to the store
+
+    Arguments:
+
+    chID -- channel ID to replace, for example chIDs[0] for IODR #1
+
+    csv_path -- path of a csv from the Download CSV button (time column then one column per tube) or a Thingspeak
+    feed csv (created_at and entry_id columns)
+
+    speed -- how many times faster than real time to replay, 1 to 1000 (default 1)
+
+    start_hours -- hours of the recording that are already there when the replay starts (default 0)
+    """
+    if not 1 <= speed <= 1000:
+        raise ValueError(f"speed must be between 1 and 1000, not {speed}")
+
+    with open(csv_path, 'rb') as f:
+        content = f.read()
+    if content.startswith(b'created_at'):
+        recording = parse_feed(content)
+    else:
+        recording = pd.read_csv(io.BytesIO(content), index_col=0)
+        recording.index = pd.to_datetime(recording.index, utc=True).tz_convert('US/Eastern').rename('time')
+        # the tubes may have been renamed, put back the Thingspeak field names and give each row an entry_id
+        recording.columns = [f'field{i + 1}' for i in range(len(recording.columns))]
+        recording.insert(0, 'entry_id', np.arange(1, len(recording) + 1))
+
+    with get_channel_lock(chID):
+        replays[chID] = {
+            'recording': recording,
+            'speed': speed,
+            'origin': recording.index[0] + pd.Timedelta(start_hours, 'h'),
+            'started_at': time.monotonic()
+        }
+        drop_held_frame(chID)
+        synced_at.pop(chID, None)
+
+
+def stop_replay(chID):
+    """Stops replaying a channel, the next sync gets it from Thingspeak again
+
+    Arguments:
+
+    chID -- channel ID being replayed
+    """
+    with get_channel_lock(chID):
+        replays.pop(chID, None)
+        drop_held_frame(chID)
+        synced_at.pop(chID, None)
+
+
+def sync_replay(chID):
+    """Returns the held dataframe for a replayed channel after appending the recorded rows whose time has come
+
+    Arguments:
+
+    chID -- channel ID being replayed
+    """
+    with get_channel_lock(chID):
+        replay = replays[chID]
+        recording = replay['recording']
+        # the time the replay clock has reached in the recording
+        elapsed = (time.monotonic() - replay['started_at']) * replay['speed']
+        replay_time = replay['origin'] + pd.Timedelta(elapsed, 's')
+
+        held = held_frames.get(chID)
+        first = 0 if held is None or len(held) == 0 else recording['entry_id'].searchsorted(
+            held['entry_id'].iloc[-1], side='right')
+        last = recording.index.searchsorted(replay_time, side='right')
+        held = append_rows(held, recording.iloc[first:max(first, last)])
+        set_held_frame(chID, held)
+        synced_at[chID] = time.monotonic()
+    return held
+
+
+def sync_channel_shared(chID, readAPIkey):
+    """Syncs a channel while holding its sync file lock. If another worker synced it in the last shared_sync_seconds,
+    the rows that worker saved are read from the store and Thingspeak isn't asked again
+
+    Arguments:
+
+    chID -- Thingspeak channel ID
+
+    readAPIkey -- read API key of the channel
+    """
+    try:
+        with sync_file_lock(chID):
+            synced_age = get_synced_age(chID)
+            if synced_age is not None and synced_age < shared_sync_seconds:
+                held = catch_up_from_store(chID)
+                if held is not None and len(held) != 0:
+                    return held
+            held = download_new_rows(chID, readAPIkey)
+            mark_synced(chID)
+            return held
+    except OSError:
+        # the store folder can't be used, sync on our own
+        logger.warning("could not use the sync lock of channel %s", chID, exc_info=True)
+        return download_new_rows(chID, readAPIkey)
+
+
+def catch_up_from_store(chID):
+    """Returns the held dataframe for a channel with the rows other workers saved to the store appended to it
+
+    Arguments:
+
+    chID -- Thingspeak channel ID
+    """
+    with get_channel_lock(chID):
+        held = held_frames.get(chID)
+        if held is None or len(held) == 0:
+            held = load_stored(chID)
+        else:
+            try:
+                stored = read_store_range(chID, start=held.index[-1])
+            except (OSError, ValueError):
+                stored = None
+            if stored is not None:
+                held = append_rows(held, stored)
+        if held is not None:
+            set_held_frame(chID, held)
+            synced_at[chID] = time.monotonic()
+    return held
+
+
+def download_new_rows(chID, readAPIkey):
+    """Returns the held dataframe for a channel after downloading the entries newer than the last held entry_id from
+    Thingspeak and saving them to the store
+
+    Arguments:
+
+    chID -- Thingspeak channel ID
+
+    readAPIkey -- read API key of the channel
+    """
+    with get_channel_lock(chID):
+        held = held_frames.get(chID)
+        myUrl = channel_url(chID, 'feeds.csv')
+
+        if held is None:
+            # after a restart, start from the history saved on disk
+            held = load_stored(chID)
+            if held is not None:
+                set_held_frame(chID, held)
+
+        if held is None or len(held) == 0:
+            # cold start, get the most recent entries
+            params = {'results': max_results}
+        else:
+            # only ask for entries created at or after the last one we have (Thingspeak times are in UTC)
+            params = {'start': ts_time(held.index[-1])}
+
+        try:
+            if held is not None and len(held) != 0 and not has_new_entries(chID, held['entry_id'].iloc[-1]):
+                synced_at[chID] = time.monotonic()
+                return held
+            r = ts_get(myUrl, params=params)
+        except requests.RequestException:
+            if held is None:
+                raise
+            # keep showing the data we already have if Thingspeak can't be reached
+            logger.warning("could not sync channel %s, using held data", chID, exc_info=True)
+            return held
+
+        new_rows = parse_feed(r.content)
+        if held is not None and len(new_rows) >= max_results:
+            # more entries arrived since the held data than one request returns, so get the gap in pages
+            new_rows = fetch_page(chID, held.index[-1], pd.Timestamp.now(tz='UTC'))
+        if held is not None and len(held) != 0:
+            # the start= parameter is inclusive, so the last held entry comes back again and isn't saved twice
+            new_rows = new_rows.loc[new_rows['entry_id'] > held['entry_id'].iloc[-1]]
+        held = append_rows(held, new_rows)
+        set_held_frame(chID, held)
+        synced_at[chID] = time.monotonic()
+        save_rows(chID, new_rows)
+        logger.debug("synced channel %s, %d new rows, %d held", chID, len(new_rows), len(held))
+
+    return held
+
+
+def has_new_entries(chID, last_entry_id):
+    """Returns True if the channel has entries after last_entry_id. Only the last entry of the channel is requested,
+    with the validators of the previous check so Thingspeak can answer 304 Not Modified without a body
+
+    Arguments:
+
+    chID -- Thingspeak channel ID
+
+    last_entry_id -- entry_id of the last held entry
+    """
+    myUrl = channel_url(chID, 'feeds/last.json')
+    validators = last_entry_validators.get(chID, {})
+    headers = {}
+    if 'ETag' in validators:
+        headers['If-None-Match'] = validators['ETag']
+    if 'Last-Modified' in validators:
+        headers['If-Modified-Since'] = validators['Last-Modified']
+
+    r = ts_get(myUrl, headers=headers)
+    if r.status_code == 304:
+        # the last entry is the same one the previous check saw
+        return validators['entry_id'] > last_entry_id
+
+    try:
+        channel_last_entry_id = int(r.json()['entry_id'])
+    except (ValueError, KeyError, TypeError):
+        # an unexpected answer, fall back to downloading the feed
+        return True
+    last_entry_validators[chID] = {key: r.headers[key] for key in ('ETag', 'Last-Modified') if key in r.headers}
+    last_entry_validators[chID]['entry_id'] = channel_last_entry_id
+    return channel_last_entry_id > last_entry_id
+
+
+def get_channel_frame(chID, readAPIkey):
+    """Returns the held dataframe for a channel, stale-while-revalidate style. A fresh frame is returned as is, a
+    stale one is returned right away while a sync runs in the background, and one older than the channel's max stale
+    seconds (or missing) is synced before returning
+
+    Arguments:
+
+    chID -- Thingspeak channel ID
+
+    readAPIkey -- read API key of the channel
+    """
+    held = held_frames.get(chID)
+    last_synced = synced_at.get(chID)
+    if held is None or last_synced is None:
+        return sync_channel(chID, readAPIkey)
+
+    age = time.monotonic() - last_synced
+    if age > channel_max_stale.get(chID, default_max_stale):
+        return sync_channel(chID, readAPIkey)
+
+    if age > fresh_seconds:
+        with in_flight_lock:
+            already_syncing = ('sync', chID) in in_flight
+        if not already_syncing:
+            revalidate_pool.submit(sync_channel, chID, readAPIkey)
+    return held
+
+
+def fetch_page(chID, page_start, page_end):
+    """Returns a dataframe from parse_feed with the entries of a channel between page_start and page_end. A page that
+    comes back with the full 8000 entries may have been cut off, so it is split in half and downloaded again
+
+    Arguments:
+
+    chID -- Thingspeak channel ID
+
+    page_start -- timezone aware Timestamp for the start of the page
+
+    page_end -- timezone aware Timestamp for the end of the page
+    """
+    myUrl = channel_url(chID, 'feeds.csv')
+    r = ts_get(myUrl, params={'start': ts_time(page_start), 'end': ts_time(page_end), 'results': max_results})
+    page = parse_feed(r.content)
+
+    if len(page) >= max_results and page_end - page_start > pd.Timedelta(1, 'min'):
+        middle = page_start + (page_end - page_start) / 2
+        page = pd.concat([fetch_page(chID, page_start, middle), fetch_page(chID, middle, page_end)])
+
+    return page
+
+
+def backfill_channel(chID, readAPIkey, start, end=None, page_hours=None, max_workers=None):
+    """Returns the held dataframe for a channel after downloading all of its entries between start and end. The time
+    range is split into pages that are downloaded in parallel, then the pages are saved and stitched together with the
+    held data and duplicate entry_ids are removed. Only the newest max_held_rows rows are held, older ones are read
+    back from the store by get_history
+
+    Arguments:
+
+    chID -- Thingspeak channel ID
+
+    readAPIkey -- read API key of the channel
+
+    start -- start of the history to load, Timestamp or string (times without a timezone are US/Eastern)
+
+    end -- end of the history to load (default now)
+
+    page_hours -- hours of history per page (default backfill_page_hours)
+
+    max_workers -- number of pages downloaded at once (default backfill_workers)
+    """
+    page_hours = page_hours or backfill_page_hours
+    max_workers = max_workers or backfill_workers
+
+    start = pd.Timestamp(start)
+    if start.tzinfo is None:
+        start = start.tz_localize('US/Eastern')
+    end = pd.Timestamp.now(tz='UTC') if end is None else pd.Timestamp(end)
+    if end.tzinfo is None:
+        end = end.tz_localize('US/Eastern')
+    start = start.tz_convert('UTC')
+    end = end.tz_convert('UTC')
+
+    # page boundaries, the last page ends at end
+    bounds = list(pd.date_range(start, end, freq=pd.Timedelta(page_hours, 'h')))
+    if bounds[-1] < end:
+        bounds.append(end)
+    pages = list(zip(bounds[:-1], bounds[1:]))
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='thingspeak-backfill') as pool:
+        frames = list(pool.map(lambda page: fetch_page(chID, *page), pages))
+    saved = save_rows(chID, pd.concat(frames).drop_duplicates(subset='entry_id'))
+
+    with get_channel_lock(chID):
+        held = held_frames.get(chID)
+        if held is not None:
+            frames.append(held)
+        # pages share their boundary second, so the same entry can show up twice
+        combined = pd.concat(frames).drop_duplicates(subset='entry_id').sort_values('entry_id')
+        set_held_frame(chID, combined.tail(max_held_rows))
+        loaded_from = start
+        if len(combined) > max_held_rows and not saved:
+            # the rows past max_held_rows are only kept in the store, which failed, so they are gone
+            loaded_from = held_frames[chID].index[0]
+            logger.warning("channel %s history before %s was dropped, more than %d rows can only be served from the "
+                           "store", chID, loaded_from, max_held_rows)
+        backfilled_from[chID] = min(loaded_from, backfilled_from.get(chID, loaded_from))
+        logger.debug("backfilled channel %s with %d pages, %d held", chID, len(pages), len(combined))
+
+    return held_frames[chID]
+
+
+def get_history(chID, readAPIkey, start):
+    """Returns a dataframe of a channel from start on, with new entries synced and older history backfilled back to
+    start. History older than the held rows (past max_held_rows) is read from the store
+
+    Arguments:
+
+    chID -- Thingspeak channel ID
+
+    readAPIkey -- read API key of the channel
+
+    start -- timezone aware Timestamp of the earliest time needed
+    """
+    held = sync_channel(chID, readAPIkey)
+    if len(held) != 0 and held.index[0] > start and backfilled_from.get(chID, held.index[0]) > start:
+        # use history saved on disk before going to Thingspeak
+        stored = read_store_range(chID, start, held.index[0])
+        if stored is not None and len(stored) != 0 and stored.index[0] - start < pd.Timedelta(1, 'h'):
+            with get_channel_lock(chID):
+                held = pd.concat([stored, held_frames[chID]]).drop_duplicates(subset='entry_id')
+                held = held.sort_values('entry_id').tail(max_held_rows)
+                set_held_frame(chID, held)
+        else:
+            held = backfill_channel(chID, readAPIkey, start, end=held.index[0])
+    if len(held) != 0 and held.index[0] > start:
+        # more history was asked for than is held, the older rows come from the store
+        stored = read_store_range(chID, start, held.index[0])
+        if stored is not None and len(stored) != 0:
+            held = pd.concat([stored, held]).drop_duplicates(subset='entry_id').sort_values('entry_id')
+    return held.loc[held.index >= start]
+
+
+def get_tiered_dataframe(chID, readAPIkey, recent_hours=None, timescale=None, history_days=None, aggregate=None):
+    """Returns a dataframe of a channel with the most recent data at full resolution and older history already
+    aggregated by Thingspeak, in the same shape cull_data returns (no entry_id column)
+
+    Arguments:
+
+    chID -- Thingspeak channel ID
+
+    readAPIkey -- read API key of the channel
+
+    recent_hours -- hours of data kept at full resolution (default tier_recent_hours)
+
+    timescale -- minutes per bucket for the older history, one of ts_timescales (default tier_timescale)
+
+    history_days -- days of older history to get (default tier_history_days)
+
+    aggregate -- how Thingspeak combines a bucket: 'average', 'median' or 'timescale' (first value) (default
+    tier_aggregate)
+    """
+    recent_hours = recent_hours or tier_recent_hours
+    timescale = timescale or tier_timescale
+    history_days = history_days or tier_history_days
+    aggregate = aggregate or tier_aggregate
+    if timescale not in ts_timescales:
+        raise ValueError(f"timescale must be one of {ts_timescales}, not {timescale}")
+    if aggregate not in ('average', 'median', 'timescale'):
+        raise ValueError(f"aggregate must be 'average', 'median' or 'timescale', not {aggregate}")
+
+    myUrl = channel_url(chID, 'feeds.csv')
+    now = pd.Timestamp.now(tz='UTC')
+    cutoff = now - pd.Timedelta(recent_hours, 'h')
+
+    held = held_frames.get(chID)
+    if held is not None and len(held) != 0 and held.index[0] <= cutoff:
+        # the held data already covers the recent window, so only new entries are downloaded
+        recent = sync_channel(chID, readAPIkey)
+    else:
+        recent = parse_feed(ts_get(myUrl, params={'start': ts_time(cutoff)}).content)
+    recent = recent.loc[recent.index > cutoff].drop('entry_id', axis='columns')
+
+    # aggregated rows don't have an entry_id
+    r = ts_get(myUrl, params={
+        'start': ts_time(now - pd.Timedelta(history_days, 'D')),
+        'end': ts_time(cutoff),
+        aggregate: timescale
+    })
+    older = parse_feed(r.content, entry_id_dtype='f8').drop('entry_id', axis='columns', errors='ignore')
+    older = older.loc[older.index <= cutoff].dropna(how='all')
+
+    selected_dataframe = pd.concat([older, recent])
+    return selected_dataframe
+
+
+def get_OD_dataframe(device, chIDs, readAPIkeys, start=None, tiered=False):
     """Returns a tuple of dataframes from Thingspeak containing the OD data for the specified device.
 
     return value 0 is the dataframe containing OD data for all tubes. Data older than two hours has been thinned.
@@ -34,6 +898,11 @@ def get_OD_dataframe(device, chIDs, readAPIkeys):
     chIDs --  list of channel IDs from main file
 
     readAPIkeys -- list of API keys from main file
+
+    start -- Timestamp to load data from, older history is backfilled if needed (default None, the last 8000 points)
+
+    tiered -- if True, return data already thinned like cull_data by getting only the recent data at full resolution
+    and older data averaged by Thingspeak (see get_tiered_dataframe) (default False)
     """
     # select the channel ID and read API key depending on which device is being used
     # chID = chIDs[devNum-1]
@@ -42,48 +911,173 @@ def get_OD_dataframe(device, chIDs, readAPIkeys):
     # readAPIkey = readAPIkeys[devNum-1]
     readAPIkey = readAPIkeys[device]
 
-    # get data from Thingspeak
-    myUrl = f'https://api.thingspeak.com/channels/{chID}/feeds.csv?results=8000'
-    # myUrl = 'https://api.thingspeak.com/channels/{channel_id}/feeds.csv?start=2021-09-20'.format(channel_id = chID)
-    # print(myUrl)
-    r = requests.get(myUrl)
+    if tiered:
+        return get_tiered_dataframe(chID, readAPIkey)
 
-    # put the thingspeak data in a dataframe
-    df = pd.read_csv(io.StringIO(r.content.decode('utf-8')))
-    # print("the first df", df)
+    if start is not None:
+        full_dataframe = get_history(chID, readAPIkey, start).drop('entry_id', axis='columns')
+        return full_dataframe
 
-    df2 = df.drop('entry_id', axis='columns')
+    # get the held data (synced with Thingspeak if needed), and only keep the most recent 8000 points for the graphs
+    held = get_channel_frame(chID, readAPIkey)
 
-    # convert time string to datetime, and switch from UTC to Eastern time
-    df2['time'] = pd.to_datetime(df2['created_at']).dt.tz_convert('US/Eastern')
+    full_dataframe = held.drop('entry_id', axis='columns').tail(max_results)
 
-    # remove the created_at column
-    df3 = df2.drop('created_at', axis='columns')
+    return full_dataframe
 
-    # set index to time
-    df4 = df3.set_index('time')
+def cull_data(dataframe, num_points=None, mode=None, tiers=None):
+    """Returns the dataframe downsampled for graphing. The 'lttb' mode keeps the newest cull_recent_hours at full
+    resolution and a fixed number of points per column before that with Largest-Triangle-Three-Buckets, which keeps
+    spikes and changes in growth that thinning by a stride drops. The 'time' mode averages older data into time
+    buckets, so the time resolution depends on the age of the data and not on the number of rows
 
+    Arguments:
 
+    dataframe -- pandas dataframe with a time index and one column per trace
 
+    num_points -- number of points to keep per column before the newest hours in 'lttb' mode (default cull_points)
 
-    # print("df8 ", df8)
-    full_dataframe = df4
+    mode -- 'lttb' or 'time' (default cull_mode)
 
-    return full_dataframe
+    tiers -- list of (hours, bucket) tiers for the 'time' mode (default time_tiers)
+    """
+    mode = mode or cull_mode
+    if mode == 'lttb':
+        if len(dataframe) == 0:
+            return dataframe
+        # the newest cull_recent_hours stay at full resolution, only the older rows are downsampled
+        cutoff = dataframe.index[-1] - pd.Timedelta(cull_recent_hours, 'h')
+        recent = dataframe.index > cutoff
+        selected_dataframe = pd.concat([lttb_frame(dataframe.loc[~recent], num_points or cull_points),
+                                        dataframe.loc[recent]])
+    elif mode == 'time':
+        selected_dataframe = time_decimate(dataframe, tiers or time_tiers)
+    else:
+        raise ValueError(f"mode must be 'lttb' or 'time', not {mode}")
+    return selected_dataframe
 
-def cull_data(dataframe):
-    first_time_time = dataframe.index[0]
-    last_time_time = dataframe.index[-1]
-    # print("first time ", first_time_time)
-    # print("last time ", last_time_time)
 
-    df5 = dataframe.loc[(dataframe.index > (last_time_time - pd.Timedelta(2, 'h'))) & (dataframe.index < last_time_time)]
+def get_envelope(dataframe, num_buckets=None):
+    """Returns a tuple of (min, max, mean) dataframes of the dataframe in equal time buckets, for drawing each tube as
+    a band (see envelope_frames)
 
-    df6 = dataframe.loc[(dataframe.index > first_time_time) & (dataframe.index < last_time_time - pd.Timedelta(2, 'h'))]
-    df7 = df6.iloc[::10]
+    Arguments:
 
-    selected_dataframe = pd.concat([df7, df5])
-    return selected_dataframe
+    dataframe -- pandas dataframe with a time index and one column per trace
+
+    num_buckets -- number of time buckets (default envelope_buckets)
+    """
+    return envelope_frames(dataframe, num_buckets or envelope_buckets)
+
+
+def get_pyramid_range(device, chIDs, start=None, end=None, num_points=None, envelope=False):
+    """Returns a dataframe in the same shape as cull_data with the OD data of a device between start and end, read
+    from the channel's pyramid so the cost depends on the points returned and not on the rows held. Returns None if
+    the channel has no pyramid yet
+
+    Arguments:
+
+    device -- int device number (0-2)
+
+    chIDs --  list of channel IDs from main file
+
+    start -- start of the range, Timestamp or string (times without a timezone are US/Eastern) (default None, from the
+    beginning)
+
+    end -- end of the range, same format as start (default None, to the end)
+
+    num_points -- most points per tube (default cull_points)
+
+    envelope -- if True return a tuple of (min, max, mean) dataframes like get_envelope instead (default False)
+    """
+    pyramid = pyramids.get(chIDs[device])
+    if pyramid is None:
+        return None
+
+    bounds = []
+    for bound in (start, end):
+        if bound is not None:
+            bound = pd.Timestamp(bound)
+            if bound.tzinfo is None:
+                bound = bound.tz_localize('US/Eastern', ambiguous=True, nonexistent='shift_forward')
+        bounds.append(bound)
+    if envelope:
+        return pyramid_envelope(pyramid, bounds[0], bounds[1], num_points or envelope_buckets)
+    return pyramid_frame(pyramid, bounds[0], bounds[1], num_points or cull_points)
+
+
+def get_full_envelope(device, chIDs, full_dataframe, offsets=None):
+    """Returns a tuple of (min, max, mean) dataframes of a device's OD data over the time range of full_dataframe, for
+    drawing the unzoomed graph's bands. They come from the channel's pyramid, or from the full resolution dataframe
+    when there is no pyramid, so the bands cover every point and not only the points kept by cull_data. The pyramid
+    can hold more history than the page loaded (another session may have backfilled it), so only the page's range is
+    read from it
+
+    Arguments:
+
+    device -- int device number (0-2)
+
+    chIDs --  list of channel IDs from main file
+
+    full_dataframe -- pandas dataframe with the full resolution OD data, one column per tube
+
+    offsets -- list of OD offsets added to each tube's column (default None, no offsets)
+    """
+    envelope = None
+    if len(full_dataframe) != 0:
+        envelope = get_pyramid_range(device, chIDs, full_dataframe.index[0], full_dataframe.index[-1], envelope=True)
+    if envelope is None:
+        envelope = get_envelope(full_dataframe)
+    if offsets is not None:
+        offsets = np.asarray(offsets, dtype='f8')
+        envelope = tuple(frame + offsets[:len(frame.columns)] for frame in envelope)
+    return envelope
+
+
+def tube_traces(dataframe, colors, ln=False, envelope=None):
+    """Returns a list of scatter traces of the tubes for the OD or ln OD plot of the main graph. Without an envelope
+    each tube is one trace of markers. With one, each tube is three traces: the bottom of the band, the top of the
+    band filled down to the bottom, and a line through the bucket means
+
+    Arguments:
+
+    dataframe -- pandas dataframe with a time index and one column per tube
+
+    colors -- list of colors of the tubes
+
+    ln -- if True plot the natural log of the OD (default False)
+
+    envelope -- tuple of (min, max, mean) dataframes from get_envelope or get_pyramid_range, or None to plot the
+    points of the dataframe (default None)
+    """
+    label = 'ln OD' if ln else 'OD'
+    suffix = ' ln' if ln else ''
+    scale = np.log if ln else (lambda values: values)
+
+    traces = []
+    for index, col in enumerate(dataframe.columns):
+        hovertemplate = 'Time: %{x}' + f'<br>{label}: ' + '%{y}<br>' + 'Trace: %{meta}<br>' + '<extra></extra>'
+        if envelope is None:
+            traces.append(go.Scatter(x=dataframe.index, y=scale(dataframe[col]), mode='markers', marker_size=5,
+                                     marker=dict(color=colors[index]), name=f"{col}{suffix}", meta=f"{col}{suffix}",
+                                     legendgroup=f"{col}", hovertemplate=hovertemplate))
+            continue
+
+        # the envelope frames keep the Thingspeak field names, so the tubes are matched by position
+        env_min, env_max, env_mean = (frame.iloc[:, index] for frame in envelope)
+        has_bucket = env_mean.notna()
+        times = env_mean.index[has_bucket]
+        # the band color is the tube color, see-through
+        red, green, blue = (int(colors[index][i:i + 2], 16) for i in (1, 3, 5))
+        traces.append(go.Scatter(x=times, y=scale(env_min[has_bucket]), mode='lines', line_width=0,
+                                 line_color=colors[index], showlegend=False, legendgroup=f"{col}", hoverinfo='skip'))
+        traces.append(go.Scatter(x=times, y=scale(env_max[has_bucket]), mode='lines', line_width=0,
+                                 line_color=colors[index], fill='tonexty', fillcolor=f'rgba({red},{green},{blue},0.3)',
+                                 showlegend=False, legendgroup=f"{col}", hoverinfo='skip'))
+        traces.append(go.Scatter(x=times, y=scale(env_mean[has_bucket]), mode='lines', line_color=colors[index],
+                                 name=f"{col}{suffix}", meta=f"{col}{suffix}", legendgroup=f"{col}",
+                                 hovertemplate=hovertemplate))
+    return traces
 
 # Not being used
 def format_OD_data(dataframe):
@@ -124,7 +1118,30 @@ def rename_tubes(dataframe, newNames):
     return
 
 
-def get_temp_data(device, chIDs, readAPIkeys):
+def get_temp_values(chID, readAPIkey):
+    """Returns a tuple of the time index and a 2d numpy array of the six temperature fields of the last 8000 entries.
+    The array is only rebuilt when the held temperature channel has changed
+
+    Arguments:
+
+    chID -- channel ID of the temperature channel
+
+    readAPIkey -- read API key of the temperature channel
+    """
+    with temp_cache_lock:
+        held = get_channel_frame(chID, readAPIkey)
+        if temp_cache['frame'] is not held:
+            tail = held.tail(max_results)
+            fields = [f'field{i}' for i in range(1, 7)]
+            # column major, so the two columns of each device sit next to each other in memory
+            temp_cache['values'] = np.asfortranarray(tail.reindex(columns=fields).to_numpy(dtype='f8'))
+            temp_cache['index'] = tail.index
+            temp_cache['frame'] = held
+
+        return temp_cache['index'], temp_cache['values']
+
+
+def get_temp_data(device, chIDs, readAPIkeys, start=None):
     """Returns a tuple of pandas dataframes containing the temperature data for the specified device with columns
     Temp Int and Temp Ext
 
@@ -137,6 +1154,8 @@ def get_temp_data(device, chIDs, readAPIkeys):
     chIDs --  list of channel IDs from main file
 
     readAPIkeys -- list of API keys from main file
+
+    start -- Timestamp to load data from, older history is backfilled if needed (default None, the last 8000 points)
     """
     # select the channel ID and read API key for temperature data
     chID = chIDs[3]
@@ -144,21 +1163,17 @@ def get_temp_data(device, chIDs, readAPIkeys):
     # readAPIkey = readAPIkeys[devNum-1]
     readAPIkey = readAPIkeys[3]
 
-    # get data from Thingspeak
-    myUrl = f'https://api.thingspeak.com/channels/{chID}/feeds.csv?results=8000'
-    # myUrl = 'https://api.thingspeak.com/channels/{channel_id}/feeds.csv?start=2021-09-20'.format(channel_id = chID)
-    # print(myUrl)
-    r = requests.get(myUrl)
-
-    # put the thingspeak data in a dataframe
-    df = pd.read_csv(io.StringIO(r.content.decode('utf-8')))
+    if start is None:
+        # the temperature of all three devices is in one channel, so share one download between them
+        time_index, temp_values = get_temp_values(chID, readAPIkey)
+        # columns 1 and 2 are device 0, 3 and 4 are device 1, 5 and 6 are device 2. This slice is a view of the
+        # cached array and copy=False keeps the dataframe from copying it
+        full_dataframe = pd.DataFrame(temp_values[:, 2 * device:2 * device + 2], index=time_index,
+                                      columns=['Temp Int', 'Temp Ext'], copy=False)
+        return full_dataframe
 
-    df2 = df.drop('entry_id', axis='columns')
-
-    # convert time string to datetime, and switch from UTC to Eastern time
-    df2['time'] = pd.to_datetime(df2['created_at']).dt.tz_convert('US/Eastern')
-    df2 = df2.drop('created_at', axis='columns')
-    df2.set_index('time', inplace=True)
+    # get any new data from Thingspeak
+    df2 = get_history(chID, readAPIkey, start).drop('entry_id', axis='columns')
 
     # format data for temperature, inlcude only temperature that matches the device selected
     if (device == 0):
@@ -189,6 +1204,114 @@ def get_temp_data(device, chIDs, readAPIkeys):
     return full_dataframe
 
 
+def get_device_data(device, chIDs, readAPIkeys, start=None):
+    """Returns a tuple of the full OD dataframe and the full temperature dataframe for the specified device. The OD
+    channel and the temperature channel are downloaded at the same time
+
+    Arguments:
+
+    device -- int device number (0-2)
+
+    chIDs --  list of channel IDs from main file
+
+    readAPIkeys -- list of API keys from main file
+
+    start -- Timestamp to load data from (default None, the last 8000 points)
+    """
+    od_future = fetch_pool.submit(get_OD_dataframe, device, chIDs, readAPIkeys, start)
+    temp_future = fetch_pool.submit(get_temp_data, device, chIDs, readAPIkeys, start)
+
+    # wait for both requests to finish
+    return od_future.result(), temp_future.result()
+
+
+def prewarm_device(device, chIDs, readAPIkeys):
+    """Gets and culls the OD and temperature data of a device and saves them, along with their json strings for the
+    dcc.Store components, in the prewarmed dict
+
+    Arguments:
+
+    device -- int device number (0-2)
+
+    chIDs --  list of channel IDs from main file
+
+    readAPIkeys -- list of API keys from main file
+    """
+    # the poller keeps the data fresh, so sync the channel instead of serving it stale
+    sync_channel(chIDs[device], readAPIkeys[device])
+    od_df_full, temp_df_full = get_device_data(device, chIDs, readAPIkeys)
+    od_df_culled = cull_data(od_df_full)
+    temp_df = cull_data(temp_df_full)
+
+    prewarmed[device] = {
+        'od_df_full': od_df_full,
+        'od_df_culled': od_df_culled,
+        'temp_df': temp_df,
+        'od_df_full_json': od_df_full.to_json(date_format='iso', orient='table'),
+        'od_df_culled_json': od_df_culled.to_json(date_format='iso', orient='table'),
+        'temp_df_json': temp_df.to_json(date_format='iso', orient='table'),
+        'made_at': time.monotonic()
+    }
+
+
+def get_prewarmed(device, max_age):
+    """Returns the dict saved by prewarm_device for a device, or None if there isn't one newer than max_age seconds
+
+    Arguments:
+
+    device -- int device number (0-2)
+
+    max_age -- maximum age in seconds
+    """
+    entry = prewarmed.get(device)
+    if entry is None or time.monotonic() - entry['made_at'] > max_age:
+        return None
+    return entry
+
+
+def start_prewarm_poller(chIDs, readAPIkeys, interval=60, devices=(0, 1, 2)):
+    """Starts a background thread that keeps the culled data of every device ready in the prewarmed dict, refreshing
+    it every interval seconds. Does nothing if the poller is already running
+
+    Arguments:
+
+    chIDs --  list of channel IDs from main file
+
+    readAPIkeys -- list of API keys from main file
+
+    interval -- seconds between refreshes (default 60)
+
+    devices -- device numbers to keep ready (default all three)
+    """
+    global prewarm_thread
+    if prewarm_thread is not None and prewarm_thread.is_alive():
+        return
+
+    def poll():
+        while not prewarm_stop.is_set():
+            try:
+                # the temperature channel is shared by all the devices, so sync it once per round
+                sync_channel(chIDs[3], readAPIkeys[3])
+            except Exception:
+                logger.warning("could not pre-warm the temperature channel", exc_info=True)
+            for device in devices:
+                try:
+                    prewarm_device(device, chIDs, readAPIkeys)
+                except Exception:
+                    # keep polling, the next round may work
+                    logger.warning("could not pre-warm device %s", device, exc_info=True)
+            prewarm_stop.wait(interval)
+
+    prewarm_stop.clear()
+    prewarm_thread = threading.Thread(target=poll, name='iodr-prewarm', daemon=True)
+    prewarm_thread.start()
+
+
+def stop_prewarm_poller():
+    """Stops the pre-warm thread after its current round"""
+    prewarm_stop.set()
+
+
 def format_ln_data(dataframe, tube_num, offset_value=0):
     """Returns a pandas dataframe with columns OD and lnOD (log transformed data), index is the time values
 
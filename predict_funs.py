@@ -11,13 +11,73 @@ from rq import Queue
 from worker import conn
 
 import logging
+import hashlib
+import warnings
+import threading
+import uuid
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
 from scipy.signal import find_peaks
 from scipy.optimize import curve_fit
 from scipy.stats import linregress
 from scipy import stats
 
+from get_data_funs import format_ln_data
+from store_funs import save_shared, load_shared, prune_shared
 
-def predict_curve(dataframe, data_range):
+logger = logging.getLogger(__name__)
+
+# prefix sum fit indexes of the ln OD data of recently shown tubes, keyed by (data revision, tube number, offset).
+# The least recently used ones are dropped past max_fit_indexes
+fit_indexes = OrderedDict()
+max_fit_indexes = 32
+# window fits of the prediction graph, keyed by (device, tube number, window, offset, data revision). The least
+# recently used ones are dropped past max_fit_results
+fit_results = OrderedDict()
+max_fit_results = 256
+# guards both caches
+cache_lock = threading.Lock()
+
+# settings of the robust fits: residuals past huber_k robust standard deviations are weighted down, the Huber fit
+# stops after huber_iterations, and Theil-Sen uses at most max_theil_sen_pairs pairs of points per tube
+huber_k = 1.345
+huber_iterations = 20
+max_theil_sen_pairs = 2000
+
+# settings of the exponential phase detection: ln OD is averaged onto a grid of phase_grid_minutes and smoothed over
+# phase_smooth_hours. A tube is taken to be growing exponentially where its growth rate is at least
+# phase_rate_fraction of its highest rate and phase_min_rate per hour, and the rate changes by no more than
+# phase_curvature_fraction of the highest rate per hour. The longest such stretch of at least phase_min_hours is used
+phase_grid_minutes = 5
+phase_smooth_hours = 1
+phase_rate_fraction = 0.5
+phase_min_rate = 0.05
+phase_curvature_fraction = 0.5
+phase_min_hours = 1
+
+# process pool the growth model fits run in, made on first use so the fits don't hold up the worker serving the app.
+# Its processes are started by a fork server, since forking the app's process while its threads hold locks can hang
+growth_pool = None
+growth_pool_lock = threading.Lock()
+growth_workers = 2
+growth_start_method = 'forkserver'
+# parameters of the last growth model fit of each tube, keyed by (key, model), used as the starting point of the next
+growth_params = {}
+# the fits of a growth job are saved to the shared store when they are done, so any gunicorn worker can collect them.
+# A job whose fits aren't saved after growth_job_timeout seconds is given up on, and uncollected fits are deleted
+# after growth_job_max_age seconds
+growth_job_timeout = 120
+growth_job_max_age = 3600
+
+# running fits of the trailing online_window_hours of every tube, keyed by channel ID then column name. Updated by
+# update_online_fits as rows are appended to the held data
+online_window_hours = 2
+online_fits = {}
+online_fits_lock = threading.Lock()
+
+
+def predict_curve(dataframe, data_range, method='ols'):
     """Returns a tuple of the list of curve information and the last collected data point for displaying the curve
 
     Arguements:
@@ -25,6 +85,8 @@ def predict_curve(dataframe, data_range):
     dataframe -- pandas dataframe with columns 'OD' and 'lnOD' that comes from function 'format_ln_data'
 
     data_range -- list of two values for the range of data to use for curve estimation
+
+    method -- 'ols' for linregress, 'huber' or 'theilsen' for a robust fit (see fit_lines) (default 'ols')
     """
     # copy the dataframe so not editing in place
     df = dataframe.copy()
@@ -47,7 +109,12 @@ def predict_curve(dataframe, data_range):
     if len(df2['lnOD']) > 2:    # makes sure the dataframe is not empty, linregress needs > 2 datapoints
         # do the curve fit
         # popt, pcov = curve_fit(curve, df2.index, df2['lnOD']) # used if using a different estimate curve than linregress
-        curve_info[0], curve_info[1], curve_info[2], p, se = linregress(df2.index, df2['lnOD'])
+        if method == 'ols':
+            curve_info[0], curve_info[1], curve_info[2], p, se = linregress(df2.index, df2['lnOD'])
+        else:
+            t = df2.index.to_numpy(dtype='f8')[:, None]
+            y = df2['lnOD'].to_numpy(dtype='f8')[:, None]
+            curve_info = [value[0] for value in fit_lines(t, y, np.isfinite(y), method)]
         # print("popt", popt)
         print("slope, intercept, r_val: ", curve_info)
     else:
@@ -66,7 +133,7 @@ def linear_curve(t, a, b):
 
 
 # move to functions file
-def estimate_times(lnDataframes, target_vals):
+def estimate_times(lnDataframes, target_vals, method='ols'):
     """Returns a tuple of a list of time estimates (strings) and a list of r_values from the prediction curves (ints)
 
     Arguments:
@@ -75,6 +142,8 @@ def estimate_times(lnDataframes, target_vals):
     datetime objects, returned from the format_ln_data function
 
     target_vals -- list of target OD values to make estimates for, must be in the same order of the lnDataframes
+
+    method -- 'ols' for linregress, 'huber' or 'theilsen' for a robust fit (see fit_lines) (default 'ols')
     """
     r_vals = []
     estimates = []
@@ -82,7 +151,7 @@ def estimate_times(lnDataframes, target_vals):
         # get the data from json file
         lnODdf = pd.read_json(lnDataframes[i], orient='table')
         print("lnODdf",  lnODdf)
-        curve_info, last_time_point = predict_curve(lnODdf, [-2, 0])    # get the prediction info
+        curve_info, last_time_point = predict_curve(lnODdf, [-2, 0], method)    # get the prediction info
 
         if len(curve_info) != 0:
 
@@ -105,3 +174,1050 @@ def estimate_times(lnDataframes, target_vals):
             r_vals.append("0")
     return estimates, r_vals
 
+
+
+# fields of the array returned by fit_all_tubes. slope is per hour, intercept is ln OD at the first time of the frame,
+# n is the number of points in the window and target_time is when the fit line reaches the target OD (NaT if never)
+fit_dtype = np.dtype([('slope', 'f8'), ('intercept', 'f8'), ('r', 'f8'), ('n', 'i8'), ('target_time', 'M8[ns]')])
+
+
+def fit_all_tubes(dataframe, offsets=None, window=(-2, 0), targets=None, method='ols'):
+    """Returns a numpy array with fit_dtype fields holding the linear fit of ln OD against time for every column of
+    the dataframe at once, like predict_curve does for one tube. Each tube's window is relative to its own last
+    reading and leaves out both ends, and tubes with fewer than 3 points in the window get NaN fits. Columns from
+    several devices can be put side by side in one dataframe
+
+    Arguments:
+
+    dataframe -- pandas dataframe with a time index and one column of OD per tube (NaN where a tube has no reading)
+
+    offsets -- list of OD offsets added to each column before taking the log (default None, no offsets)
+
+    window -- hours before the last reading of each tube to fit, [start, end], or one [start, end] row per tube
+    like exponential_windows returns (default (-2, 0))
+
+    targets -- list of target OD values to get the time to (default None, target_time is NaT)
+
+    method -- 'ols' for least squares, 'huber' or 'theilsen' for fits that single spikes don't pull off (see
+    fit_lines) (default 'ols')
+    """
+    num_tubes = len(dataframe.columns)
+    fits = np.zeros(num_tubes, dtype=fit_dtype)
+    if len(dataframe) == 0:
+        fits['slope'] = fits['intercept'] = fits['r'] = np.nan
+        fits['target_time'] = np.datetime64('NaT')
+        return fits
+
+    od = dataframe.to_numpy(dtype='f8')
+    if offsets is not None:
+        od = od + np.asarray(offsets, dtype='f8')[:num_tubes]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ln_od = np.log(od)
+
+    # hours since the first time of the frame, the same time origin for every tube
+    time_ns = dataframe.index.to_numpy(dtype='datetime64[ns]').view('i8')
+    hours = (time_ns - time_ns[0]) / 3.6e12
+
+    # the last time each tube has a reading, then the window relative to it
+    has_od = ~np.isnan(od)
+    last_row = len(od) - 1 - np.argmax(has_od[::-1], axis=0)
+    last_hours = hours[last_row]
+    t = hours[:, None]
+    window = np.broadcast_to(np.asarray(window, dtype='f8'), (num_tubes, 2))
+    in_window = (t > last_hours + window[:, 0]) & (t < last_hours + window[:, 1]) & np.isfinite(ln_od) & \
+        has_od.any(axis=0)
+
+    n = in_window.sum(axis=0)
+    slope, intercept, r = fit_lines(np.broadcast_to(t, ln_od.shape), ln_od, in_window, method)
+
+    # linregress needs more than 2 points
+    too_few = n <= 2
+    fits['slope'] = np.where(too_few, np.nan, slope)
+    fits['intercept'] = np.where(too_few, np.nan, intercept)
+    fits['r'] = np.where(too_few, np.nan, r)
+    fits['n'] = n
+    fits['target_time'] = target_times(fits, time_ns[0], targets)
+    return fits
+
+
+def weighted_lines(t, y, weights):
+    """Returns a tuple of arrays of the slope, intercept and r of the weighted least squares line of each column,
+    from centered sums. Points with a weight of 0 are left out
+
+    Arguments:
+
+    t -- 2d numpy array of times, one column per tube
+
+    y -- 2d numpy array of values the same shape as t
+
+    weights -- 2d numpy array of weights the same shape as t
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        total = weights.sum(axis=0)
+        t_mean = np.where(weights > 0, weights * t, 0).sum(axis=0) / total
+        y_mean = np.where(weights > 0, weights * y, 0).sum(axis=0) / total
+        dt = np.where(weights > 0, t - t_mean, 0)
+        dy = np.where(weights > 0, y - y_mean, 0)
+        s_tt = (weights * dt * dt).sum(axis=0)
+        s_ty = (weights * dt * dy).sum(axis=0)
+        s_yy = (weights * dy * dy).sum(axis=0)
+        slope = s_ty / s_tt
+        r = s_ty / np.sqrt(s_tt * s_yy)
+    intercept = y_mean - slope * t_mean
+    return slope, intercept, r
+
+
+def huber_weights(residuals, mask):
+    """Returns the Huber weights of the residuals of each column: 1 within huber_k robust standard deviations (from
+    the median absolute deviation) and falling off as 1/|residual| past that, 0 outside the mask
+
+    Arguments:
+
+    residuals -- 2d numpy array of residuals, one column per tube
+
+    mask -- 2d numpy boolean array of the points in the fit
+    """
+    masked = np.where(mask, residuals, np.nan)
+    with warnings.catch_warnings():
+        # columns without points have no median
+        warnings.simplefilter('ignore', RuntimeWarning)
+        center = np.nanmedian(masked, axis=0)
+        scale = 1.4826 * np.nanmedian(np.abs(masked - center), axis=0)
+    scale = np.where(scale > 0, scale, 1e-12)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weights = np.minimum(1, huber_k * scale / np.abs(residuals))
+    return np.where(mask, np.nan_to_num(weights, nan=1.0), 0)
+
+
+def theil_sen_slopes(t, y, mask):
+    """Returns the Theil-Sen slope of each column: the median of the slopes between pairs of its points. Columns with
+    more than max_theil_sen_pairs pairs use that many random pairs
+
+    Arguments:
+
+    t -- 2d numpy array of times, one column per tube
+
+    y -- 2d numpy array of values the same shape as t
+
+    mask -- 2d numpy boolean array of the points in the fit
+    """
+    num_cols = t.shape[1]
+    counts = mask.sum(axis=0)
+    width = max(counts.max(), 1)
+    # the rows of each column's points, padded to the same length
+    rows = np.zeros((num_cols, width), dtype=int)
+    for col in range(num_cols):
+        valid = np.flatnonzero(mask[:, col])
+        rows[col, :len(valid)] = valid
+
+    if width * (width - 1) // 2 <= max_theil_sen_pairs:
+        # every pair
+        first, second = np.triu_indices(width, k=1)
+        first = np.broadcast_to(first, (num_cols, len(first)))
+        second = np.broadcast_to(second, (num_cols, len(second)))
+    else:
+        rng = np.random.default_rng(0)
+        first = (rng.random((num_cols, max_theil_sen_pairs)) * counts[:, None]).astype(int)
+        second = (rng.random((num_cols, max_theil_sen_pairs)) * counts[:, None]).astype(int)
+    in_column = (first < counts[:, None]) & (second < counts[:, None])
+
+    cols = np.arange(num_cols)[:, None]
+    rows_a = np.take_along_axis(rows, np.minimum(first, width - 1), axis=1)
+    rows_b = np.take_along_axis(rows, np.minimum(second, width - 1), axis=1)
+    dt = t[rows_b, cols] - t[rows_a, cols]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slopes = (y[rows_b, cols] - y[rows_a, cols]) / dt
+    slopes[~in_column | (dt == 0)] = np.nan
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanmedian(slopes, axis=1)
+
+
+def fit_lines(t, y, mask, method='ols'):
+    """Returns a tuple of arrays of the slope, intercept and r of a line fitted to the masked points of each column.
+    'ols' is least squares. 'huber' reweights least squares by the Huber weights of the residuals until it settles,
+    and 'theilsen' takes the median slope of pairs of points and the median intercept. For the robust methods r is
+    the weighted r with the Huber weights of the final residuals, so a spike doesn't drag r down either
+
+    Arguments:
+
+    t -- 2d numpy array of times, one column per tube
+
+    y -- 2d numpy array of values the same shape as t
+
+    mask -- 2d numpy boolean array of the points to fit
+
+    method -- 'ols', 'huber' or 'theilsen' (default 'ols')
+    """
+    weights = mask.astype('f8')
+    if method == 'ols':
+        return weighted_lines(t, y, weights)
+
+    if method == 'huber':
+        slope, intercept, _ = weighted_lines(t, y, weights)
+        for _ in range(huber_iterations):
+            weights = huber_weights(y - (slope * t + intercept), mask)
+            new_slope, intercept, _ = weighted_lines(t, y, weights)
+            settled = np.allclose(new_slope, slope, rtol=1e-6, atol=1e-9, equal_nan=True)
+            slope = new_slope
+            if settled:
+                break
+    elif method == 'theilsen':
+        slope = theil_sen_slopes(t, y, mask)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            intercept = np.nanmedian(np.where(mask, y - slope * t, np.nan), axis=0)
+    else:
+        raise ValueError(f"method must be 'ols', 'huber' or 'theilsen', not {method}")
+
+    weights = huber_weights(y - (slope * t + intercept), mask)
+    _, _, r = weighted_lines(t, y, weights)
+    return slope, intercept, r
+
+
+def target_times(fits, origin_ns, targets):
+    """Returns a datetime64[ns] array (UTC) of when each fit line reaches its target OD, NaT where it doesn't
+
+    Arguments:
+
+    fits -- array from fit_all_tubes
+
+    origin_ns -- time the fit intercepts are at, in ns since the epoch
+
+    targets -- list of target OD values, one per fit (None for all NaT)
+    """
+    if targets is None:
+        return np.full(len(fits), np.datetime64('NaT'), dtype='M8[ns]')
+    targets = pd.to_numeric(pd.Series(list(targets), dtype=object), errors='coerce').to_numpy(dtype='f8')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # solve for t = (y - b) / slope
+        hours = (np.log(targets) - fits['intercept']) / fits['slope']
+    # keep the times datetime64 can hold
+    reachable = np.isfinite(hours) & (np.abs(hours) < 1e6)
+    target_ns = origin_ns + np.where(reachable, hours, 0) * 3.6e12
+    return np.where(reachable, target_ns.astype('i8'), np.datetime64('NaT').astype('i8')).view('M8[ns]')
+
+
+def format_estimates(fits, tz='US/Eastern'):
+    """Returns a tuple of a list of time estimates (strings) and a list of r^2 values (strings) from the fits, in the
+    format estimate_times returns them for the table
+
+    Arguments:
+
+    fits -- array from fit_all_tubes
+
+    tz -- timezone the estimates are shown in, None for the time index of a frame without a timezone (default
+    'US/Eastern')
+    """
+    times = pd.to_datetime(fits['target_time'], utc=True)
+    times = times.tz_convert(tz) if tz is not None else times.tz_localize(None)
+    estimates = []
+    r_vals = []
+    for fit, time_target in zip(fits, times):
+        if np.isnan(fit['slope']):
+            estimates.append("none")
+            r_vals.append("0")
+            continue
+        estimates.append(time_target.strftime("%Y-%m-%d %H:%M:%S") if not pd.isna(time_target) else "none")
+        r_vals.append(f"{fit['r']**2}"[0:5])     # r^2 values
+    return estimates, r_vals
+
+
+def data_revision(data_json):
+    """Returns a short hash of a stored json, so a revision of the data can be used as a cache key
+
+    Arguments:
+
+    data_json -- json string from a store component
+    """
+    return hashlib.blake2b(data_json.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def build_fit_index(dataframe):
+    """Returns a dict with the times of a tube in hours since its first point and the running sums of 1, t, y, t^2,
+    t*y and y^2 (y being ln OD), so the linear fit of any time window can be found from two rows of the sums
+
+    Arguments:
+
+    dataframe -- pandas dataframe with columns 'OD' and 'lnOD' that comes from function 'format_ln_data'
+    """
+    hours = ((dataframe.index - dataframe.index[0]) / pd.Timedelta(1, 'h')).to_numpy(dtype='f8') \
+        if len(dataframe) != 0 else np.zeros(0)
+    ln_od = dataframe['lnOD'].to_numpy(dtype='f8')
+    # points without a usable ln OD count for nothing, like the dropna in predict_curve
+    valid = np.isfinite(ln_od)
+    t = np.where(valid, hours, 0)
+    y = np.where(valid, ln_od, 0)
+    terms = np.stack([valid.astype('f8'), t, y, t * t, t * y, y * y], axis=1)
+    sums = np.concatenate([np.zeros((1, 6)), np.cumsum(terms, axis=0)])
+    return {'hours': hours, 'ln_od': ln_od, 'sums': sums}
+
+
+def window_fit(fit_index, data_range, method='ols'):
+    """Returns a tuple of the list of curve information (slope, intercept, r) and the last time point in hours, the
+    same as predict_curve, using the sums of the fit index so the cost doesn't depend on the number of points. The
+    robust methods fit the points of the window instead
+
+    Arguments:
+
+    fit_index -- dict from build_fit_index
+
+    data_range -- list of two values for the range of data to use for curve estimation, in hours from the last point
+
+    method -- 'ols' for least squares, 'huber' or 'theilsen' for a robust fit (see fit_lines) (default 'ols')
+    """
+    hours = fit_index['hours']
+    if len(hours) == 0:
+        return [], 0
+    last_time_point = hours[-1]
+    # the window leaves out both ends like predict_curve
+    lo = np.searchsorted(hours, last_time_point + data_range[0], side='right')
+    hi = max(lo, np.searchsorted(hours, last_time_point + data_range[1], side='left'))
+    n, s_t, s_y, s_tt, s_ty, s_yy = fit_index['sums'][hi] - fit_index['sums'][lo]
+
+    if n <= 2:  # linregress needs > 2 datapoints
+        return [], last_time_point
+    if method != 'ols':
+        t = hours[lo:hi, None]
+        y = fit_index['ln_od'][lo:hi, None]
+        return [value[0] for value in fit_lines(t, y, np.isfinite(y), method)], last_time_point
+    cov_ty = s_ty - s_t * s_y / n
+    var_t = s_tt - s_t * s_t / n
+    var_y = s_yy - s_y * s_y / n
+    slope = cov_ty / var_t
+    intercept = (s_y - slope * s_t) / n
+    r = cov_ty / np.sqrt(var_t * var_y) if var_t * var_y > 0 else 0.0
+    return [slope, intercept, r], last_time_point
+
+
+def cached_call(cache, max_size, key, function, *args):
+    """Returns function(*args), from the cache if it was called with the same key before. The cache is an
+    OrderedDict kept in least recently used order, and the oldest entries are dropped past max_size
+
+    Arguments:
+
+    cache -- OrderedDict of results
+
+    max_size -- most results kept
+
+    key -- hashable key of the call
+
+    function -- function to call on a miss
+
+    args -- arguments of the function
+    """
+    with cache_lock:
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+
+    result = function(*args)
+
+    with cache_lock:
+        cache[key] = result
+        while len(cache) > max_size:
+            cache.popitem(last=False)
+    return result
+
+
+def make_ln_fit_index(od_df_json, tube_num, offset_value):
+    """Returns a tuple of the ln OD dataframe of a tube (from format_ln_data) and its fit index
+
+    Arguments:
+
+    od_df_json -- json of the OD dataframe from the od_df_update_store
+
+    tube_num -- number (int) of which tube to get data on
+
+    offset_value -- number for offset of OD data
+    """
+    od_df = pd.read_json(od_df_json, orient='table')
+    ln_od_df = format_ln_data(od_df, tube_num, offset_value=offset_value)
+    return ln_od_df, build_fit_index(ln_od_df)
+
+
+def get_ln_fit_index(od_df_json, tube_num, offset_value=0):
+    """Returns a tuple of the ln OD dataframe of a tube (from format_ln_data) and its fit index. The pair is kept for
+    each revision of the data, so moving the sliders doesn't read the json or rebuild the sums again
+
+    Arguments:
+
+    od_df_json -- json of the OD dataframe from the od_df_update_store
+
+    tube_num -- number (int) of which tube to get data on
+
+    offset_value -- number for offset of OD data (default 0)
+    """
+    key = (data_revision(od_df_json), tube_num, float(offset_value))
+    return cached_call(fit_indexes, max_fit_indexes, key, make_ln_fit_index, od_df_json, tube_num, offset_value)
+
+
+def get_window_fit(device, od_df_json, tube_num, data_range, offset_value=0, method='ols'):
+    """Returns a tuple of the ln OD dataframe of a tube, the list of curve information (slope, intercept, r) of the
+    window and the last time point in hours. Fits are kept by device, tube, window, offset and data revision, so
+    inputs that don't change the fit (like the target OD) don't fit again
+
+    Arguments:
+
+    device -- int device number (0-2)
+
+    od_df_json -- json of the OD dataframe from the od_df_update_store
+
+    tube_num -- number (int) of which tube to get data on
+
+    data_range -- list of two values for the range of data to use for curve estimation, in hours from the last point
+
+    offset_value -- number for offset of OD data (default 0)
+
+    method -- 'ols' for least squares, 'huber' or 'theilsen' for a robust fit (see fit_lines) (default 'ols')
+    """
+    revision = data_revision(od_df_json)
+    ln_od_df, fit_index = cached_call(fit_indexes, max_fit_indexes, (revision, tube_num, float(offset_value)),
+                                      make_ln_fit_index, od_df_json, tube_num, offset_value)
+    key = (device, tube_num, tuple(data_range), float(offset_value), revision, method)
+    curve_info, last_time_point = cached_call(fit_results, max_fit_results, key, window_fit, fit_index, data_range,
+                                              method)
+    return ln_od_df, curve_info, last_time_point
+
+
+def target_hours(curve_info, target):
+    """Returns the time in hours from a tube's first point when its fit line reaches the target OD, solving only
+    for t = (ln(target) - intercept) / slope
+
+    Arguments:
+
+    curve_info -- list of slope, intercept and r from window_fit or predict_curve
+
+    target -- target OD value
+    """
+    return (np.log(target) - curve_info[1]) / curve_info[0]
+
+
+def new_online_fit(offset_value=0):
+    """Returns an empty running fit of one tube: the points in the window and the sums of 1, t, y, t^2, t*y and y^2
+    over them, with t in hours since the fit's origin and y the ln of the OD plus the offset
+
+    Arguments:
+
+    offset_value -- number for offset of OD data (default 0)
+    """
+    return {'points': deque(), 'sums': np.zeros(6), 'origin_ns': None, 'offset': offset_value, 'changes': 0}
+
+
+def online_terms(fit, time_ns, od):
+    """Returns the array of 1, t, y, t^2, t*y and y^2 of one point of a running fit, all zero if the ln OD isn't a
+    number
+
+    Arguments:
+
+    fit -- running fit from new_online_fit
+
+    time_ns -- time of the point in ns since the epoch
+
+    od -- OD of the point
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        y = np.log(od + fit['offset'])
+    if not np.isfinite(y):
+        return np.zeros(6)
+    t = (time_ns - fit['origin_ns']) / 3.6e12
+    return np.array([1, t, y, t * t, t * y, y * y])
+
+
+def recompute_online_fit(fit):
+    """Sums the points of a running fit again from its oldest point, which clears the rounding error that adding and
+    taking away points builds up and keeps t small
+
+    Arguments:
+
+    fit -- running fit from new_online_fit
+    """
+    fit['origin_ns'] = fit['points'][0][0] if len(fit['points']) != 0 else None
+    fit['sums'] = np.zeros(6)
+    for time_ns, od in fit['points']:
+        fit['sums'] += online_terms(fit, time_ns, od)
+    fit['changes'] = 0
+
+
+def add_online_point(fit, time_ns, od):
+    """Adds a point to a running fit and takes away the points that have left the trailing window, each in constant
+    time. Points older than the newest point are ignored
+
+    Arguments:
+
+    fit -- running fit from new_online_fit
+
+    time_ns -- time of the point in ns since the epoch
+
+    od -- OD of the point
+    """
+    points = fit['points']
+    if len(points) != 0 and time_ns <= points[-1][0]:
+        return
+    if fit['origin_ns'] is None:
+        fit['origin_ns'] = time_ns
+    points.append((time_ns, od))
+    fit['sums'] += online_terms(fit, time_ns, od)
+
+    window_start = time_ns - online_window_hours * 3.6e12
+    while points[0][0] <= window_start:
+        old_time_ns, old_od = points.popleft()
+        fit['sums'] -= online_terms(fit, old_time_ns, old_od)
+        fit['changes'] += 1
+
+    # sum again once every point has been replaced, so it stays constant time per point on average
+    if fit['changes'] > len(points):
+        recompute_online_fit(fit)
+
+
+def set_online_offset(chID, col, offset_value):
+    """Changes the OD offset of a tube's running fit, summing its points again
+
+    Arguments:
+
+    chID -- Thingspeak channel ID
+
+    col -- column name of the tube, for example 'field1'
+
+    offset_value -- number for offset of OD data
+    """
+    with online_fits_lock:
+        fit = online_fits.setdefault(chID, {}).setdefault(col, new_online_fit())
+        fit['offset'] = offset_value
+        recompute_online_fit(fit)
+
+
+def update_online_fits(chID, new_rows):
+    """Adds newly appended rows of a channel to the running fits of its tubes. Used as an append listener of the data
+    layer (see get_data_funs.add_append_listener). Rows older than what the fits have seen, like a replay starting
+    over, start the fits of the channel again
+
+    Arguments:
+
+    chID -- Thingspeak channel ID
+
+    new_rows -- dataframe of the new rows with a time index, an entry_id column and one column per tube
+    """
+    times = new_rows.index.to_numpy(dtype='datetime64[ns]').view('i8')
+    with online_fits_lock:
+        channel_fits = online_fits.setdefault(chID, {})
+        for col in new_rows.columns:
+            if col == 'entry_id':
+                continue
+            fit = channel_fits.get(col)
+            if fit is None or (len(fit['points']) != 0 and times[0] < fit['points'][-1][0]):
+                fit = channel_fits[col] = new_online_fit(fit['offset'] if fit is not None else 0)
+            values = new_rows[col].to_numpy(dtype='f8')
+            has_od = ~np.isnan(values)
+            # only the last window of the new rows can stay in the fit
+            keep = times > times[-1] - online_window_hours * 3.6e12
+            for time_ns, od in zip(times[has_od & keep], values[has_od & keep]):
+                add_online_point(fit, int(time_ns), float(od))
+
+
+def set_online_offsets(chID, offsets, columns=None):
+    """Sets the OD offsets of the running fits of a channel's tubes, only summing again the fits whose offset changed
+
+    Arguments:
+
+    chID -- Thingspeak channel ID
+
+    offsets -- list of OD offsets, one per tube
+
+    columns -- list of the tubes' column names (default None, field1, field2...)
+    """
+    columns = columns or [f'field{i + 1}' for i in range(len(offsets))]
+    for col, offset_value in zip(columns, offsets):
+        with online_fits_lock:
+            fit = online_fits.get(chID, {}).get(col)
+            unchanged = fit is not None and fit['offset'] == float(offset_value)
+        if not unchanged:
+            set_online_offset(chID, col, float(offset_value))
+
+
+def get_online_fits(chID, targets=None, columns=None):
+    """Returns a numpy array with fit_dtype fields of the running fits of a channel's tubes. Each fit only uses its
+    sums, so this doesn't depend on the number of points. The intercept is ln OD at each tube's own origin, and tubes
+    with fewer than 3 points (or no running fit) get NaN fits
+
+    Arguments:
+
+    chID -- Thingspeak channel ID
+
+    targets -- list of target OD values to get the time to (default None, target_time is NaT)
+
+    columns -- list of the tubes' column names in the order to return them (default None, the order they were added)
+    """
+    with online_fits_lock:
+        channel_fits = online_fits.get(chID, {})
+        columns = columns or list(channel_fits)
+        empty = new_online_fit()
+        sums = np.array([channel_fits.get(col, empty)['sums'] for col in columns]).reshape(-1, 6)
+        origins = np.array([channel_fits.get(col, empty)['origin_ns'] or 0 for col in columns], dtype='i8')
+
+    n, s_t, s_y, s_tt, s_ty, s_yy = sums.T
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov_ty = s_ty - s_t * s_y / n
+        var_t = s_tt - s_t * s_t / n
+        var_y = s_yy - s_y * s_y / n
+        slope = cov_ty / var_t
+        intercept = (s_y - slope * s_t) / n
+        r = cov_ty / np.sqrt(var_t * var_y)
+
+    fits = np.zeros(len(columns), dtype=fit_dtype)
+    too_few = n <= 2
+    fits['slope'] = np.where(too_few, np.nan, slope)
+    fits['intercept'] = np.where(too_few, np.nan, intercept)
+    fits['r'] = np.where(too_few, np.nan, r)
+    fits['n'] = n
+    fits['target_time'] = target_times(fits, origins, targets)
+    return fits
+
+
+def longest_runs(mask):
+    """Returns a tuple of arrays with the start row and the row after the end of the longest run of True values in
+    each column of a 2d boolean array, and its length (0 where a column has no True values)
+
+    Arguments:
+
+    mask -- 2d numpy boolean array, one column per tube
+    """
+    num_cols = mask.shape[1]
+    # +1 where a run starts and -1 after it ends, with the columns laid end to end
+    padded = np.zeros((num_cols, mask.shape[0] + 2), dtype='i1')
+    padded[:, 1:-1] = mask.T
+    steps = np.diff(padded, axis=1)
+    start_cols, starts = np.nonzero(steps == 1)
+    _, ends = np.nonzero(steps == -1)
+    lengths = ends - starts
+
+    best_start = np.zeros(num_cols, dtype=int)
+    best_end = np.zeros(num_cols, dtype=int)
+    best_length = np.zeros(num_cols, dtype=int)
+    if len(starts) != 0:
+        # the longest run of each column comes first when sorted by column then by length, longest first
+        order = np.lexsort((-lengths, start_cols))
+        cols, first = np.unique(start_cols[order], return_index=True)
+        picked = order[first]
+        best_start[cols] = starts[picked]
+        best_end[cols] = ends[picked]
+        best_length[cols] = lengths[picked]
+    return best_start, best_end, best_length
+
+
+def exponential_windows(dataframe, offsets=None, fallback=(-2, 0)):
+    """Returns a numpy array with one [start, end] row per column of the window of hours before each tube's last
+    reading where it grows exponentially, found from the growth rate and its change on smoothed ln OD. All the
+    columns are worked on at once, so the tubes of several devices can be put side by side in one dataframe. Tubes
+    with no exponential phase get the fallback window. The result can be passed as the window of fit_all_tubes
+
+    Arguments:
+
+    dataframe -- pandas dataframe with a time index and one column of OD per tube (NaN where a tube has no reading)
+
+    offsets -- list of OD offsets added to each column before taking the log (default None, no offsets)
+
+    fallback -- window for tubes without an exponential phase, None to leave them NaN (default (-2, 0))
+    """
+    num_tubes = len(dataframe.columns)
+    windows = np.tile(np.asarray(fallback if fallback is not None else (np.nan, np.nan), dtype='f8'), (num_tubes, 1))
+    if len(dataframe) < 2:
+        return windows
+
+    od = dataframe.to_numpy(dtype='f8')
+    if offsets is not None:
+        od = od + np.asarray(offsets, dtype='f8')[:num_tubes]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ln_od = np.log(od)
+    ln_od[~np.isfinite(ln_od)] = np.nan
+    ln_od_df = pd.DataFrame(ln_od, index=dataframe.index)
+
+    # a regular grid, with the gaps between readings filled in, then a centered moving average
+    grid = ln_od_df.resample(f'{phase_grid_minutes}min').mean().interpolate(limit_area='inside')
+    smooth_points = max(int(phase_smooth_hours * 60 / phase_grid_minutes), 1)
+    smoothed = grid.rolling(smooth_points, center=True, min_periods=smooth_points // 2 + 1).mean().to_numpy()
+    if len(smoothed) < 3:
+        return windows
+
+    grid_hours = phase_grid_minutes / 60
+    with np.errstate(invalid='ignore'):
+        rate = np.gradient(smoothed, grid_hours, axis=0)
+        curvature = np.gradient(rate, grid_hours, axis=0)
+    with np.errstate(invalid='ignore'), warnings.catch_warnings():
+        # all NaN columns have no max
+        warnings.simplefilter('ignore', RuntimeWarning)
+        max_rate = np.nanmax(rate, axis=0)
+    with np.errstate(invalid='ignore'):
+        growing = (rate >= phase_rate_fraction * max_rate) & (rate >= phase_min_rate) & \
+            (np.abs(curvature) <= phase_curvature_fraction * max_rate)
+
+    starts, ends, lengths = longest_runs(growing)
+    found = lengths * grid_hours >= phase_min_hours
+
+    # the window in hours before each tube's last reading, padded by half a grid step since fit windows leave out
+    # both ends
+    time_ns = dataframe.index.to_numpy(dtype='datetime64[ns]').view('i8')
+    has_od = ~np.isnan(od)
+    last_ns = time_ns[len(od) - 1 - np.argmax(has_od[::-1], axis=0)]
+    grid_ns = grid.index.to_numpy(dtype='datetime64[ns]').view('i8') + int(phase_grid_minutes * 30e9)
+    start_hours = (grid_ns[starts] - last_ns) / 3.6e12 - grid_hours / 2
+    end_hours = (grid_ns[np.maximum(ends - 1, 0)] - last_ns) / 3.6e12 + grid_hours / 2
+    windows[found, 0] = start_hours[found]
+    windows[found, 1] = end_hours[found]
+    return windows
+
+
+def exponential_windows_by_device(frames, offsets=None, fallback=(-2, 0)):
+    """Returns a list with the exponential_windows array of each device, found for all the devices in one batch
+
+    Arguments:
+
+    frames -- list of OD dataframes, one per device
+
+    offsets -- list of lists of OD offsets, one per device (default None, no offsets)
+
+    fallback -- window for tubes without an exponential phase (default (-2, 0))
+    """
+    combined = pd.concat(frames, axis=1, keys=range(len(frames))).sort_index()
+    combined_offsets = None
+    if offsets is not None:
+        combined_offsets = np.concatenate([np.asarray(device_offsets, dtype='f8')[:len(frame.columns)]
+                                           for frame, device_offsets in zip(frames, offsets)])
+    windows = exponential_windows(combined, combined_offsets, fallback)
+    splits = np.cumsum([len(frame.columns) for frame in frames])[:-1]
+    return np.split(windows, splits)
+
+
+def gompertz(t, y0, A, mu, lam):
+    """Returns the modified Gompertz curve (Zwietering et al. 1990) of ln OD: y0 at the start, rising by A with a
+    highest rate of mu per hour after a lag of lam hours
+    """
+    B = mu * np.e / A * (lam - t) + 1
+    return y0 + A * np.exp(-np.exp(B))
+
+
+def gompertz_jacobian(t, y0, A, mu, lam):
+    """Returns the derivatives of gompertz by y0, A, mu and lam, one column each"""
+    B = mu * np.e / A * (lam - t) + 1
+    G = np.exp(-np.exp(B))
+    # derivative of the curve by B
+    dB = -A * G * np.exp(B)
+    return np.stack([
+        np.ones_like(t),
+        G + dB * (-mu * np.e * (lam - t) / A ** 2),
+        dB * np.e * (lam - t) / A,
+        dB * mu * np.e / A
+    ], axis=1)
+
+
+def logistic(t, y0, A, mu, lam):
+    """Returns the modified logistic curve (Zwietering et al. 1990) of ln OD: y0 at the start, rising by A with a
+    highest rate of mu per hour after a lag of lam hours
+    """
+    C = 4 * mu / A * (lam - t) + 2
+    return y0 + A / (1 + np.exp(C))
+
+
+def logistic_jacobian(t, y0, A, mu, lam):
+    """Returns the derivatives of logistic by y0, A, mu and lam, one column each"""
+    C = 4 * mu / A * (lam - t) + 2
+    E = np.exp(C)
+    # derivative of the curve by C
+    dC = -A * E / (1 + E) ** 2
+    return np.stack([
+        np.ones_like(t),
+        1 / (1 + E) + dC * (-4 * mu * (lam - t) / A ** 2),
+        dC * 4 * (lam - t) / A,
+        dC * 4 * mu / A
+    ], axis=1)
+
+
+def baranyi_terms(t, A, mu, lam):
+    """Returns a tuple of mu times the adjusted time of the Baranyi model and the parts needed for its derivatives"""
+    h0 = mu * lam
+    q = np.exp(-mu * t) + np.exp(-h0) - np.exp(-mu * t - h0)
+    u = mu * t + np.log(q)
+    D = 1 + (np.exp(u) - 1) * np.exp(-A)
+    return h0, q, u, D
+
+
+def baranyi(t, y0, A, mu, lam):
+    """Returns the Baranyi and Roberts (1994) curve of ln OD: y0 at the start, rising by A with a highest rate of mu
+    per hour after a lag of lam hours
+    """
+    _, _, u, D = baranyi_terms(t, A, mu, lam)
+    return y0 + u - np.log(D)
+
+
+def baranyi_jacobian(t, y0, A, mu, lam):
+    """Returns the derivatives of baranyi by y0, A, mu and lam, one column each"""
+    h0, q, u, D = baranyi_terms(t, A, mu, lam)
+    du_dmu = t + (-t * np.exp(-mu * t) - lam * np.exp(-h0) + (t + lam) * np.exp(-mu * t - h0)) / q
+    du_dlam = (-mu * np.exp(-h0) + mu * np.exp(-mu * t - h0)) / q
+    # derivative of the curve by u
+    du = 1 - np.exp(u - A) / D
+    return np.stack([
+        np.ones_like(t),
+        (np.exp(u) - 1) * np.exp(-A) / D,
+        du * du_dmu,
+        du * du_dlam
+    ], axis=1)
+
+
+# growth models by name, each a curve of ln OD and its jacobian taking (t, y0, A, mu, lam)
+growth_models = {
+    'gompertz': (gompertz, gompertz_jacobian),
+    'logistic': (logistic, logistic_jacobian),
+    'baranyi': (baranyi, baranyi_jacobian)
+}
+
+
+def growth_guess(hours, ln_od):
+    """Returns starting parameters (y0, A, mu, lam) for a growth model fit from the data: the lowest and highest ln
+    OD, the steepest slope of the smoothed data and where the tangent there crosses the starting level
+
+    Arguments:
+
+    hours -- numpy array of times in hours
+
+    ln_od -- numpy array of ln OD values
+    """
+    y0 = np.percentile(ln_od, 5)
+    A = max(np.percentile(ln_od, 95) - y0, 0.1)
+    points = max(len(ln_od) // 20, 1)
+    smoothed = np.convolve(ln_od, np.ones(points) / points, mode='same')
+    slopes = np.gradient(smoothed, hours)
+    # leave out the ends the moving average doesn't cover
+    inner = slice(points, max(len(slopes) - points, points + 1))
+    steepest = inner.start + np.argmax(slopes[inner]) if len(slopes[inner]) != 0 else np.argmax(slopes)
+    mu = max(slopes[steepest], 0.01)
+    lam = max(hours[steepest] - (smoothed[steepest] - y0) / mu, 0)
+    return np.array([y0, A, mu, lam])
+
+
+def fit_growth_task(hours, ln_od, model, p0):
+    """Returns a dict of a growth model fit, for running in the process pool. Fits from p0 first, then from a guess
+    from the data if that fails. The dict has the parameters, the lag (hours), highest growth rate mu max (per hour),
+    carrying capacity (the highest OD of the curve) and r^2, or None for the parameters if no fit was found
+
+    Arguments:
+
+    hours -- numpy array of times in hours since the first point
+
+    ln_od -- numpy array of ln OD values
+
+    model -- name of the model in growth_models
+
+    p0 -- starting parameters (y0, A, mu, lam), or None to guess them
+    """
+    function, jacobian = growth_models[model]
+    result = {'params': None, 'lag': np.nan, 'mu_max': np.nan, 'capacity': np.nan, 'r2': np.nan}
+    if len(hours) < 5:
+        return result
+
+    starts = [p0, growth_guess(hours, ln_od)] if p0 is not None else [growth_guess(hours, ln_od)]
+    # A and mu above zero, the lag after the start of the data
+    bounds = ([-np.inf, 1e-6, 1e-6, hours[0] - 1], [np.inf, np.inf, np.inf, hours[-1] + 1])
+    for start in starts:
+        start = np.clip(start, np.array(bounds[0]) + 1e-9, np.array(bounds[1]) - 1e-9)
+        try:
+            with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+                params, _ = curve_fit(function, hours, ln_od, p0=start, jac=jacobian, bounds=bounds, max_nfev=2000)
+        except (RuntimeError, ValueError):
+            continue
+        y0, A, mu, lam = params
+        residuals = ln_od - function(hours, *params)
+        total = ((ln_od - ln_od.mean()) ** 2).sum()
+        result.update(params=params, lag=lam, mu_max=mu, capacity=np.exp(y0 + A),
+                      r2=1 - (residuals ** 2).sum() / total if total > 0 else np.nan)
+        break
+    return result
+
+
+def get_growth_pool():
+    """Returns the process pool the growth model fits run in, making it on first use"""
+    global growth_pool
+    with growth_pool_lock:
+        if growth_pool is None:
+            growth_pool = ProcessPoolExecutor(max_workers=growth_workers,
+                                              mp_context=multiprocessing.get_context(growth_start_method))
+        return growth_pool
+
+
+def growth_tasks(dataframe, model, offsets=None, keys=None):
+    """Returns a list with the arguments of fit_growth_task for each column of a dataframe. Each fit starts from the
+    parameters of the last fit with the same key and model when there is one
+
+    Arguments:
+
+    dataframe -- pandas dataframe with a time index and one column of OD per tube (NaN where a tube has no reading)
+
+    model -- 'gompertz', 'logistic' or 'baranyi'
+
+    offsets -- list of OD offsets added to each column before taking the log (default None, no offsets)
+
+    keys -- list of hashable keys of the tubes for reusing their last fit, for example (device, tube number) (default
+    None, always start from a guess)
+    """
+    if model not in growth_models:
+        raise ValueError(f"model must be one of {list(growth_models)}, not {model}")
+
+    tasks = []
+    for i, col in enumerate(dataframe.columns):
+        od = dataframe[col].dropna()
+        if offsets is not None:
+            od = od + float(offsets[i])
+        od = od.loc[od > 0]
+        hours = ((od.index - dataframe.index[0]) / pd.Timedelta(1, 'h')).to_numpy(dtype='f8')
+        p0 = growth_params.get((keys[i], model)) if keys is not None else None
+        tasks.append((hours, np.log(od.to_numpy(dtype='f8')), model, p0))
+    return tasks
+
+
+def save_growth_params(results, model, keys=None):
+    """Keeps the parameters of successful growth model fits as the starting point of the next fit of each tube
+
+    Arguments:
+
+    results -- list of dicts from fit_growth_task
+
+    model -- model the results are fits of
+
+    keys -- list of the tubes' keys (default None, nothing is kept)
+    """
+    if keys is not None:
+        for key, result in zip(keys, results):
+            if result['params'] is not None:
+                growth_params[(key, model)] = result['params']
+
+
+def fit_growth_models(dataframe, model='gompertz', offsets=None, keys=None, use_pool=True):
+    """Returns a list with a dict per column of the growth model fit of its ln OD (see fit_growth_task), fitted in the
+    process pool. Each fit starts from the parameters of the last fit with the same key and model when there is one.
+    This waits for the fits, see start_growth_job for fitting in the background
+
+    Arguments:
+
+    dataframe -- pandas dataframe with a time index and one column of OD per tube (NaN where a tube has no reading)
+
+    model -- 'gompertz', 'logistic' or 'baranyi' (default 'gompertz')
+
+    offsets -- list of OD offsets added to each column before taking the log (default None, no offsets)
+
+    keys -- list of hashable keys of the tubes for reusing their last fit, for example (device, tube number) (default
+    None, always start from a guess)
+
+    use_pool -- if False fit in this process (default True)
+    """
+    tasks = growth_tasks(dataframe, model, offsets, keys)
+    if use_pool:
+        futures = [get_growth_pool().submit(fit_growth_task, *task) for task in tasks]
+        results = [future.result() for future in futures]
+    else:
+        results = [fit_growth_task(*task) for task in tasks]
+    save_growth_params(results, model, keys)
+    return results
+
+
+def start_growth_job(dataframe, model='gompertz', offsets=None, keys=None):
+    """Starts fitting a growth model to every column of a dataframe in the process pool and returns the job's ID
+    without waiting for the fits. Once they are all done the fits are saved to the shared store, so any worker can
+    check on the job with growth_job_done and get the fits with collect_growth_job
+
+    Arguments:
+
+    dataframe -- pandas dataframe with a time index and one column of OD per tube (NaN where a tube has no reading)
+
+    model -- 'gompertz', 'logistic' or 'baranyi' (default 'gompertz')
+
+    offsets -- list of OD offsets added to each column before taking the log (default None, no offsets)
+
+    keys -- list of hashable keys of the tubes for reusing their last fit, for example (device, tube number) (default
+    None, always start from a guess)
+    """
+    prune_shared(growth_job_max_age)
+    tasks = growth_tasks(dataframe, model, offsets, keys)
+    job_id = uuid.uuid4().hex
+    futures = []
+    remaining = [len(tasks)]
+    remaining_lock = threading.Lock()
+
+    def save_job(future):
+        with remaining_lock:
+            remaining[0] -= 1
+            if remaining[0] != 0:
+                return
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception:   # for example a broken pool, the tube just gets no fit
+                logger.exception("growth model fit failed")
+                results.append({'params': None, 'lag': np.nan, 'mu_max': np.nan, 'capacity': np.nan, 'r2': np.nan})
+        save_growth_params(results, model, keys)
+        save_shared(f'growth_{job_id}', [
+            dict(result, params=None if result['params'] is None else np.asarray(result['params']).tolist())
+            for result in results])
+
+    futures.extend(get_growth_pool().submit(fit_growth_task, *task) for task in tasks)
+    for future in futures:
+        future.add_done_callback(save_job)
+    if len(tasks) == 0:
+        save_shared(f'growth_{job_id}', [])
+    return job_id
+
+
+def growth_job_done(job_id):
+    """Returns True if the fits of a growth job have been saved, by whichever worker started it
+
+    Arguments:
+
+    job_id -- ID from start_growth_job
+    """
+    return load_shared(f'growth_{job_id}') is not None
+
+
+def collect_growth_job(job_id):
+    """Returns the list of fits of a growth job (see fit_growth_task) and deletes them from the shared store. Returns
+    None if the fits aren't saved yet
+
+    Arguments:
+
+    job_id -- ID from start_growth_job
+    """
+    return load_shared(f'growth_{job_id}', remove=True)
+
+
+def fit_table_tubes(dataframe, chID, targets, offsets=None, table_offsets=None, method='ols'):
+    """Returns a numpy array with fit_dtype fields of the fits the table estimates are made from. Tubes with an
+    exponential phase are fitted over it. Tubes without one use the running least squares fit of their last
+    online_window_hours of full resolution data when there is one, and otherwise the last 2 hours of the dataframe
+
+    Arguments:
+
+    dataframe -- pandas dataframe with a time index and one column of OD per tube (NaN where a tube has no reading)
+
+    chID -- Thingspeak channel ID of the device
+
+    targets -- list of target OD values to get the time to
+
+    offsets -- list of OD offsets to add to the dataframe's columns (default None, already added)
+
+    table_offsets -- list of the table's OD offsets, which the running fits use (default None, offsets)
+
+    method -- 'ols' for least squares, 'huber' or 'theilsen' for a robust fit (see fit_lines) (default 'ols')
+    """
+    windows = exponential_windows(dataframe, offsets, fallback=None)
+    no_phase = np.isnan(windows[:, 0])
+    windows[no_phase] = [-2, 0]
+    fits = fit_all_tubes(dataframe, offsets, window=windows, targets=targets, method=method)
+
+    # the running fits are least squares, so they only stand in for least squares fits
+    table_offsets = table_offsets if table_offsets is not None else offsets
+    if method == 'ols' and table_offsets is not None:
+        columns = [f'field{i + 1}' for i in range(len(dataframe.columns))]
+        set_online_offsets(chID, table_offsets, columns)
+        online = get_online_fits(chID, targets, columns)
+        use_online = no_phase & (online['n'] > 2)
+        fits[use_online] = online[use_online]
+    return fits
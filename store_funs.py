@@ -0,0 +1,376 @@
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # windows, only the lock between threads is used
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# folder the channel history is saved in. Each channel has its own folder with one file of records per day (UTC).
+# The history only lasts across restarts if IODR_STORE_DIR points at persistent storage. The default is a folder in
+# the working directory, which on Heroku is wiped every time a dyno restarts (at least once a day), so there the store
+# is only a cache shared by the gunicorn workers of one dyno and history is downloaded from Thingspeak again
+store_dir = os.getenv('IODR_STORE_DIR', 'data_store')
+if 'IODR_STORE_DIR' not in os.environ and 'DYNO' in os.environ:
+    logger.warning("IODR_STORE_DIR isn't set, the saved history is lost when the dyno restarts")
+# guards writes between threads in this process, the lock file guards writes between gunicorn workers
+store_thread_lock = threading.Lock()
+
+
+def channel_dir(chID):
+    """Returns the folder the records of a channel are saved in
+
+    Arguments:
+
+    chID -- Thingspeak channel ID
+    """
+    return os.path.join(store_dir, str(chID))
+
+
+def record_dtype(columns):
+    """Returns the numpy dtype of one saved record: entry_id, time in ns since epoch (UTC), then one float per field
+
+    Arguments:
+
+    columns -- list of field column names
+    """
+    return np.dtype([('entry_id', '<i8'), ('time', '<i8')] + [(col, '<f8') for col in columns])
+
+
+@contextmanager
+def store_lock(chID):
+    """Context manager that holds the write lock of a channel folder for this process and for other processes
+
+    Arguments:
+
+    chID -- Thingspeak channel ID
+    """
+    with store_thread_lock:
+        os.makedirs(channel_dir(chID), exist_ok=True)
+        with open(os.path.join(channel_dir(chID), '.lock'), 'w') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@contextmanager
+def sync_file_lock(chID):
+    """Context manager that holds the sync lock of a channel, so only one gunicorn worker at a time downloads a
+    channel from Thingspeak. Separate from store_lock so saving rows doesn't wait on a download
+
+    Arguments:
+
+    chID -- Thingspeak channel ID
+    """
+    os.makedirs(channel_dir(chID), exist_ok=True)
+    with open(os.path.join(channel_dir(chID), '.sync.lock'), 'w') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def mark_synced(chID):
+    """Records that a channel was just synced with Thingspeak by any worker
+
+    Arguments:
+
+    chID -- Thingspeak channel ID
+    """
+    os.makedirs(channel_dir(chID), exist_ok=True)
+    with open(os.path.join(channel_dir(chID), '.synced'), 'w'):
+        pass
+
+
+def get_synced_age(chID):
+    """Returns the seconds since any worker last synced a channel with Thingspeak, or None if it never has
+
+    Arguments:
+
+    chID -- Thingspeak channel ID
+    """
+    path = os.path.join(channel_dir(chID), '.synced')
+    if not os.path.exists(path):
+        return None
+    return time.time() - os.path.getmtime(path)
+
+
+def get_store_columns(chID):
+    """Returns the list of field columns saved for a channel, or None if nothing has been saved yet
+
+    Arguments:
+
+    chID -- Thingspeak channel ID
+    """
+    path = os.path.join(channel_dir(chID), 'columns.json')
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def partition_files(chID):
+    """Returns the sorted list of day partition file paths of a channel
+
+    Arguments:
+
+    chID -- Thingspeak channel ID
+    """
+    folder = channel_dir(chID)
+    if not os.path.isdir(folder):
+        return []
+    return [os.path.join(folder, name) for name in sorted(os.listdir(folder)) if name.endswith('.bin')]
+
+
+def map_partition(path, dtype):
+    """Returns a read only memory map of the records in a partition file. The pages are shared by every process that
+    maps the same file, so the history isn't copied into each worker
+
+    Arguments:
+
+    path -- path of the partition file
+
+    dtype -- record dtype from record_dtype
+    """
+    # ignore a partly written record at the end of the file
+    num_records = os.path.getsize(path) // dtype.itemsize
+    if num_records == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(num_records,))
+
+
+def frame_to_records(dataframe, columns):
+    """Returns a numpy record array of a held dataframe (time index, entry_id column and field columns)
+
+    Arguments:
+
+    dataframe -- pandas dataframe with the time as the index and an entry_id column
+
+    columns -- list of field columns to save
+    """
+    records = np.zeros(len(dataframe), dtype=record_dtype(columns))
+    records['entry_id'] = dataframe['entry_id'].to_numpy()
+    records['time'] = dataframe.index.tz_convert('UTC').tz_localize(None).to_numpy(dtype='datetime64[ns]').view('i8')
+    for col in columns:
+        records[col] = dataframe[col].to_numpy(dtype='f8') if col in dataframe.columns else np.nan
+    return records
+
+
+def records_to_frame(records, columns):
+    """Returns a dataframe in the held format (US/Eastern time index, entry_id column and field columns) from records
+
+    Arguments:
+
+    records -- numpy record array from the store
+
+    columns -- list of field columns
+    """
+    time = pd.to_datetime(records['time'], utc=True).tz_convert('US/Eastern')
+    data = {'entry_id': records['entry_id']}
+    for col in columns:
+        data[col] = records[col]
+    return pd.DataFrame(data, index=pd.DatetimeIndex(time, name='time'))
+
+
+def store_frame(chID, dataframe):
+    """Saves the rows of a held dataframe to the store of a channel, partitioned by day. Rows newer than everything in
+    a partition are appended to its file, while older rows (from a backfill) are merged in and the partition is
+    rewritten
+
+    Arguments:
+
+    chID -- Thingspeak channel ID
+
+    dataframe -- pandas dataframe with the time as the index and an entry_id column
+    """
+    if dataframe is None or len(dataframe) == 0:
+        return
+
+    with store_lock(chID):
+        columns = get_store_columns(chID)
+        if columns is None:
+            columns = [col for col in dataframe.columns if col != 'entry_id']
+            with open(os.path.join(channel_dir(chID), 'columns.json'), 'w') as f:
+                json.dump(columns, f)
+        dtype = record_dtype(columns)
+
+        records = frame_to_records(dataframe, columns)
+        days = records['time'].astype('datetime64[ns]').astype('datetime64[D]')
+
+        for day in np.unique(days):
+            day_records = records[days == day]
+            path = os.path.join(channel_dir(chID), f'{day}.bin')
+            stored = map_partition(path, dtype) if os.path.exists(path) else np.zeros(0, dtype=dtype)
+            if len(stored) != 0:
+                # entries already in the partition aren't written again, so a repeated entry doesn't force a rewrite
+                day_records = day_records[~np.isin(day_records['entry_id'], stored['entry_id'])]
+                if len(day_records) == 0:
+                    continue
+
+            if len(stored) == 0 or day_records['entry_id'].min() > stored['entry_id'][-1]:
+                # the common case, only new entries
+                with open(path, 'ab') as f:
+                    f.write(np.sort(day_records, order='entry_id').tobytes())
+            else:
+                combined = np.concatenate([np.asarray(stored), day_records])
+                _, keep = np.unique(combined['entry_id'], return_index=True)
+                # write to a temporary file and swap it in, readers keep the old file until they reopen
+                tmp_path = path + '.tmp'
+                with open(tmp_path, 'wb') as f:
+                    f.write(combined[keep].tobytes())
+                os.replace(tmp_path, path)
+
+
+def read_store_range(chID, start=None, end=None):
+    """Returns a dataframe in the held format with the saved rows of a channel between start and end, or None if
+    nothing is saved. Only the day partitions that overlap the range are read
+
+    Arguments:
+
+    chID -- Thingspeak channel ID
+
+    start -- timezone aware Timestamp for the start of the range (default None, from the beginning)
+
+    end -- timezone aware Timestamp for the end of the range (default None, to the end)
+    """
+    columns = get_store_columns(chID)
+    if columns is None:
+        return None
+    dtype = record_dtype(columns)
+
+    start_ns = start.tz_convert('UTC').value if start is not None else np.iinfo('i8').min
+    end_ns = end.tz_convert('UTC').value if end is not None else np.iinfo('i8').max
+    start_day = str(start.tz_convert('UTC').date()) if start is not None else ''
+    end_day = str(end.tz_convert('UTC').date()) if end is not None else '9999'
+
+    chunks = []
+    for path in partition_files(chID):
+        day = os.path.basename(path)[:-4]
+        if day < start_day or day > end_day:
+            continue
+        records = map_partition(path, dtype)
+        # partitions are sorted by time, so the range can be found with a binary search
+        lo = np.searchsorted(records['time'], start_ns, side='left')
+        hi = np.searchsorted(records['time'], end_ns, side='right')
+        chunks.append(records[lo:hi])
+
+    if len(chunks) == 0:
+        return None
+    return records_to_frame(np.concatenate(chunks), columns)
+
+
+def read_store_tail(chID, num_rows):
+    """Returns a dataframe in the held format with the last num_rows saved rows of a channel, or None if nothing is
+    saved
+
+    Arguments:
+
+    chID -- Thingspeak channel ID
+
+    num_rows -- number of rows to read
+    """
+    columns = get_store_columns(chID)
+    if columns is None:
+        return None
+    dtype = record_dtype(columns)
+
+    chunks = []
+    count = 0
+    # walk back from the newest partition until there are enough rows
+    for path in reversed(partition_files(chID)):
+        records = map_partition(path, dtype)
+        chunks.insert(0, records)
+        count += len(records)
+        if count >= num_rows:
+            break
+
+    if count == 0:
+        return None
+    return records_to_frame(np.concatenate(chunks)[-num_rows:], columns)
+
+
+def shared_path(name):
+    """Returns the path of a JSON file shared between gunicorn workers
+
+    Arguments:
+
+    name -- name of the file without the extension
+    """
+    return os.path.join(store_dir, 'shared', f'{name}.json')
+
+
+def save_shared(name, data):
+    """Saves data as a JSON file any gunicorn worker can read with load_shared. The file is written under a temporary
+    name and swapped in, so readers never see half of it
+
+    Arguments:
+
+    name -- name of the file without the extension
+
+    data -- JSON serializable data
+    """
+    path = shared_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def load_shared(name, remove=False):
+    """Returns the data saved by save_shared, or None if there is none
+
+    Arguments:
+
+    name -- name of the file without the extension
+
+    remove -- if True the file is deleted after reading it (default False)
+    """
+    path = shared_path(name)
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    if remove:
+        try:
+            os.remove(path)
+        except FileNotFoundError:   # another worker read it at the same time
+            pass
+    return data
+
+
+def prune_shared(max_age):
+    """Deletes the shared files that are older than max_age seconds, for example results nobody collected
+
+    Arguments:
+
+    max_age -- age in seconds
+    """
+    folder = os.path.join(store_dir, 'shared')
+    if not os.path.isdir(folder):
+        return
+    now = time.time()
+    for file_name in os.listdir(folder):
+        path = os.path.join(folder, file_name)
+        try:
+            if now - os.path.getmtime(path) > max_age:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,318 @@
+"""Local stand-in for the Thingspeak channels API, for benchmarking and load testing the app without using the real
+API. It replays recorded channel csv files (the format of feeds.csv) with a simulated network latency.
+
+Run with:
+
+    python thingspeak_standin.py --data recorded --synthesize
+    THINGSPEAK_BASE_URL=http://localhost:8080/channels python IODR_test7.py
+"""
+import os
+import io
+import gzip
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import pandas as pd
+import requests
+
+# channels of the three IODR devices and the temperature channel, same as the main file
+od_channels = [405675, 441742, 469909]
+temp_channel = 890567
+
+# bucket sizes in minutes Thingspeak accepts for average=, median= and timescale=
+timescales = [10, 15, 20, 30, 60, 240, 720, 1440]
+# results Thingspeak returns when no range is asked for, and the most it returns at once
+default_results = 100
+max_results = 8000
+
+# recorded feeds keyed by channel ID, each a dataframe with a UTC time index and entry_id and field columns
+channels = {}
+channels_lock = threading.Lock()
+# mean and standard deviation of the simulated latency in seconds
+latency = {'mean': 0.15, 'jitter': 0.05}
+
+
+def make_feed_csv(num_rows=8000, num_fields=8, start='2022-03-01', step_seconds=20, temperature=False, seed=0):
+    """Returns the bytes of a Thingspeak style feed csv. OD feeds follow a logistic growth curve with noise, and each
+    entry only has a value for one tube like the IODR devices write them. Temperature feeds hold a pair of internal
+    and external temperatures for each device
+
+    Arguments:
+
+    num_rows -- number of entries in the feed (default 8000)
+
+    num_fields -- number of field columns (default 8)
+
+    start -- time of the first entry (UTC) (default '2022-03-01')
+
+    step_seconds -- seconds between entries (default 20)
+
+    temperature -- if True make temperature data instead of OD data (default False)
+
+    seed -- random seed (default 0)
+    """
+    rng = np.random.default_rng(seed)
+    times = pd.date_range(start, periods=num_rows, freq=f'{step_seconds}s', tz='UTC')
+    df = pd.DataFrame({
+        'created_at': times.strftime('%Y-%m-%d %H:%M:%S UTC'),
+        'entry_id': np.arange(1, num_rows + 1)
+    })
+    hours = np.arange(num_rows) * step_seconds / 3600
+    for i in range(num_fields):
+        if temperature:
+            values = np.round(50 + 5 * np.sin(hours / 24 * 2 * np.pi + i) + rng.normal(0, 0.2, num_rows), 2)
+            df[f'field{i + 1}'] = values
+        else:
+            # each tube grows with its own rate and lag
+            rate = 0.3 + 0.05 * i
+            lag = 4 + 2 * i
+            od = 0.01 + 1.2 / (1 + np.exp(-rate * (hours - lag - 15)))
+            values = np.round(od + rng.normal(0, 0.002, num_rows), 4)
+            # only one tube is written per entry
+            df[f'field{i + 1}'] = np.where(np.arange(num_rows) % num_fields == i, values, np.nan)
+    return df.to_csv(index=False).encode('utf-8')
+
+
+def read_feed_csv(content):
+    """Returns a dataframe of a feed csv with a UTC time index
+
+    Arguments:
+
+    content -- bytes of a feed csv
+    """
+    df = pd.read_csv(io.BytesIO(content))
+    df.index = pd.DatetimeIndex(pd.to_datetime(df.pop('created_at'), utc=True), name='created_at')
+    return df
+
+
+def load_channels(data_dir, shift_to_now=False):
+    """Loads every <channel ID>.csv file in data_dir into the channels dict
+
+    Arguments:
+
+    data_dir -- folder with the recorded feeds
+
+    shift_to_now -- if True move the times of each feed so its last entry is now (default False)
+    """
+    for name in sorted(os.listdir(data_dir)):
+        if not name.endswith('.csv'):
+            continue
+        with open(os.path.join(data_dir, name), 'rb') as f:
+            feed = read_feed_csv(f.read())
+        if shift_to_now and len(feed) != 0:
+            feed.index = feed.index + (pd.Timestamp.now(tz='UTC').floor('s') - feed.index[-1])
+        with channels_lock:
+            channels[int(name[:-4])] = feed
+        print(f"loaded channel {name[:-4]} with {len(feed)} entries")
+
+
+def synthesize_channels(data_dir, num_rows=8000):
+    """Writes synthetic recordings of the three OD channels and the temperature channel to data_dir, ending now
+
+    Arguments:
+
+    data_dir -- folder to write the feeds to
+
+    num_rows -- number of entries per channel (default 8000)
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    start = (pd.Timestamp.now(tz='UTC').floor('s') - pd.Timedelta(num_rows * 20, 's')).tz_localize(None)
+    for seed, chID in enumerate(od_channels):
+        with open(os.path.join(data_dir, f'{chID}.csv'), 'wb') as f:
+            f.write(make_feed_csv(num_rows, start=start, seed=seed))
+    with open(os.path.join(data_dir, f'{temp_channel}.csv'), 'wb') as f:
+        f.write(make_feed_csv(num_rows, num_fields=6, start=start, temperature=True))
+
+
+def record_channels(data_dir, chIDs, base_url='https://api.thingspeak.com/channels'):
+    """Downloads the last 8000 entries of each channel from Thingspeak into data_dir for replaying later
+
+    Arguments:
+
+    data_dir -- folder to write the feeds to
+
+    chIDs -- list of channel IDs to record
+
+    base_url -- url of the Thingspeak channels API (default the real one)
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    for chID in chIDs:
+        r = requests.get(f'{base_url}/{chID}/feeds.csv', params={'results': max_results}, timeout=(3.05, 30))
+        r.raise_for_status()
+        with open(os.path.join(data_dir, f'{chID}.csv'), 'wb') as f:
+            f.write(r.content)
+        print(f"recorded channel {chID}")
+
+
+def parse_time(value):
+    """Returns a UTC Timestamp from a start= or end= parameter (YYYY-MM-DD HH:NN:SS, in UTC)
+
+    Arguments:
+
+    value -- parameter string
+    """
+    timestamp = pd.Timestamp(value)
+    return timestamp.tz_localize('UTC') if timestamp.tzinfo is None else timestamp.tz_convert('UTC')
+
+
+def select_entries(feed, params):
+    """Returns the entries of a feed selected by the query parameters the way Thingspeak does: start=, end=, days=,
+    minutes= and results=, then average=, median= or timescale= aggregation
+
+    Arguments:
+
+    feed -- dataframe from read_feed_csv
+
+    params -- dict of query parameters, each a single string
+    """
+    selected = feed
+    now = pd.Timestamp.now(tz='UTC')
+    has_range = False
+    if 'start' in params:
+        selected = selected.loc[selected.index >= parse_time(params['start'])]
+        has_range = True
+    if 'end' in params:
+        selected = selected.loc[selected.index <= parse_time(params['end'])]
+        has_range = True
+    if 'days' in params:
+        selected = selected.loc[selected.index >= now - pd.Timedelta(float(params['days']), 'D')]
+        has_range = True
+    if 'minutes' in params:
+        selected = selected.loc[selected.index >= now - pd.Timedelta(float(params['minutes']), 'min')]
+        has_range = True
+
+    results = int(params.get('results', max_results if has_range else default_results))
+    selected = selected.tail(min(results, max_results))
+
+    for aggregate in ('average', 'median', 'timescale'):
+        if aggregate not in params:
+            continue
+        minutes = int(params[aggregate])
+        if minutes not in timescales:
+            raise ValueError(f"{aggregate} must be one of {timescales}")
+        fields = selected.drop('entry_id', axis='columns')
+        buckets = fields.index.floor(f'{minutes}min')
+        if aggregate == 'average':
+            fields = fields.groupby(buckets).mean()
+        elif aggregate == 'median':
+            fields = fields.groupby(buckets).median()
+        else:
+            fields = fields.groupby(buckets).first()
+        # aggregated rows don't have an entry_id
+        fields.insert(0, 'entry_id', np.nan)
+        fields.index.name = 'created_at'
+        selected = fields
+        break
+
+    return selected
+
+
+def feed_to_csv(feed):
+    """Returns the bytes of a feed dataframe as a Thingspeak csv
+
+    Arguments:
+
+    feed -- dataframe with a UTC time index
+    """
+    out = feed.copy()
+    out.insert(0, 'created_at', out.index.strftime('%Y-%m-%d %H:%M:%S UTC'))
+    return out.to_csv(index=False).encode('utf-8')
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    """Answers Thingspeak channel requests from the recorded feeds"""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        parts = url.path.strip('/').split('/')
+
+        # simulated network and server time
+        time.sleep(max(0.0, random.gauss(latency['mean'], latency['jitter'])))
+
+        if len(parts) < 3 or parts[0] != 'channels' or not parts[1].isdigit():
+            return self.send_body(404, b'-1', 'text/plain')
+        with channels_lock:
+            feed = channels.get(int(parts[1]))
+        if feed is None:
+            return self.send_body(404, b'-1', 'text/plain')
+
+        endpoint = '/'.join(parts[2:])
+        if endpoint == 'feeds.csv':
+            try:
+                body = feed_to_csv(select_entries(feed, params))
+            except ValueError as error:
+                return self.send_body(400, str(error).encode('utf-8'), 'text/plain')
+            return self.send_body(200, body, 'text/csv')
+
+        if endpoint == 'feeds/last.json':
+            if len(feed) == 0:
+                return self.send_body(200, b'-1', 'application/json')
+            last = feed.iloc[-1]
+            etag = f'"{int(last["entry_id"])}"'
+            if self.headers.get('If-None-Match') == etag:
+                return self.send_body(304, b'', 'application/json', {'ETag': etag})
+            entry = {'created_at': feed.index[-1].strftime('%Y-%m-%dT%H:%M:%SZ'), 'entry_id': int(last['entry_id'])}
+            for col in feed.columns.drop('entry_id'):
+                entry[col] = None if pd.isna(last[col]) else str(last[col])
+            return self.send_body(200, json.dumps(entry).encode('utf-8'), 'application/json', {'ETag': etag})
+
+        return self.send_body(404, b'-1', 'text/plain')
+
+    def send_body(self, status, body, content_type, headers=None):
+        """Sends a response, gzipped if the client accepts it"""
+        if 'gzip' in self.headers.get('Accept-Encoding', '') and len(body) != 0:
+            body = gzip.compress(body)
+            headers = dict(headers or {}, **{'Content-Encoding': 'gzip'})
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if status != 304:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(port=8080, host='127.0.0.1'):
+    """Returns a threaded http server answering from the channels dict, call serve_forever() on it to start it
+
+    Arguments:
+
+    port -- port to listen on (default 8080)
+
+    host -- address to listen on (default 127.0.0.1)
+    """
+    return ThreadingHTTPServer((host, port), StandinHandler)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for the Thingspeak channels API')
+    parser.add_argument('--data', default='recorded', help='folder with <channel ID>.csv recordings')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=150, help='mean simulated latency in ms')
+    parser.add_argument('--jitter', type=float, default=50, help='standard deviation of the latency in ms')
+    parser.add_argument('--synthesize', action='store_true', help='write synthetic recordings of all channels first')
+    parser.add_argument('--record', type=int, nargs='*', help='record these channels from Thingspeak first')
+    parser.add_argument('--shift-to-now', action='store_true', help='move each recording so it ends now')
+    args = parser.parse_args()
+
+    if args.synthesize:
+        synthesize_channels(args.data)
+    if args.record:
+        record_channels(args.data, args.record)
+    latency['mean'] = args.latency / 1000
+    latency['jitter'] = args.jitter / 1000
+    load_channels(args.data, shift_to_now=args.shift_to_now)
+
+    print(f"serving on http://127.0.0.1:{args.port}/channels")
+    make_server(args.port).serve_forever()